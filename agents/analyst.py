@@ -1,33 +1,61 @@
 """Analyst Director — handles data analysis, reporting, and SEC scan tasks."""
 
+import contextvars
 import json
+import re
 import subprocess
+import time
 import sys
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from pathlib import Path
 from agents.base import BaseDirector
+from database import set_task_progress, renew_lease, get_sec_scan, put_sec_scan
 from workers.claude_worker import run as claude_run
 from workers.shell_worker import run as shell_run
+from workers.errors import WorkerError, WorkerTimeout
+from workers.output import run_streaming
 from audit import log as audit_log
+from router import Router, best
 
 SEC_SCANNER_VENV = Path.home() / "projects/sec-scanner/.venv/bin/sec-scanner"
 SEC_SCANNER_DIR  = Path.home() / "projects/sec-scanner"
+# One ticker per line (# comments allowed). When present, watchlist scans are
+# sharded per ticker; otherwise they fall back to a single `--watchlist` run.
+SEC_WATCHLIST_FILE = SEC_SCANNER_DIR / "watchlist.txt"
+
+SEC_SCAN_TIMEOUT = 600        # single run (one ticker, or unsharded --watchlist)
+SEC_TICKER_TIMEOUT = 300      # per-ticker shard of a watchlist scan
+SEC_SCAN_CONCURRENCY = 4      # scanner processes running at once per watchlist scan
+
+# Per-ticker scan results are reused for this long unless the task asks for
+# "refresh": true. The scanner only reports a ticker's latest filing after
+# scanning it, so age is the staleness signal. The filing id is recorded so
+# a re-scan can tell whether anything new was filed.
+SEC_CACHE_MAX_AGE = 12 * 3600
+# SEC accession number, e.g. 0000320193-24-000123
+ACCESSION_RE = re.compile(r"\b\d{10}-\d{2}-\d{6}\b")
+
+# Prompt keywords that pick an analyst sub-type. main.py folds these into its
+# router and stamps payload["task_type"] at enqueue; tasks queued without one
+# are classified here.
+SEC_SCAN_KEYWORDS = ["sec scan", "sec scanner", "ai washing", "watchlist scan", "scan ticker"]
+ANALYST_SUBTYPES = {"sec_scan": SEC_SCAN_KEYWORDS}
+_subtype_router = Router(analyst=ANALYST_SUBTYPES)
 
 
 class AnalystDirector(BaseDirector):
     name = "analyst"
+    lease_seconds = 900   # SEC scans may run up to 600s; sharded scans renew it per ticker
 
     def run_task(self, task: dict) -> str:
         payload = json.loads(task["payload"]) if task["payload"] else {}
         prompt    = payload.get("prompt", "")
-        task_type = payload.get("task_type", "general")
+        task_type = payload.get("task_type") or best(_subtype_router.scan(prompt)["analyst"], "general")
         shell_cmd = payload.get("shell_cmd")
 
         # ── SEC scan task ──────────────────────────────────────────────
-        if task_type == "sec_scan" or any(
-            kw in prompt.lower()
-            for kw in ["sec scan", "sec scanner", "ai washing", "watchlist scan", "scan ticker"]
-        ):
-            return self._run_sec_scan(payload)
+        if task_type == "sec_scan":
+            return self._run_sec_scan(payload, task)
 
         # ── Generic shell + analyze ────────────────────────────────────
         if shell_cmd:
@@ -39,9 +67,13 @@ class AnalystDirector(BaseDirector):
         else:
             full_prompt = f"Analysis task: {prompt}\n\nProvide a clear, structured analysis."
 
-        return claude_run(full_prompt)
+        context = self.prompt_context(task, prompt, payload)
+        if context:
+            full_prompt = f"{context}\n\n{full_prompt}"
 
-    def _run_sec_scan(self, payload: dict) -> str:
+        return claude_run(full_prompt, cache=payload.get("cache", True))
+
+    def _run_sec_scan(self, payload: dict, task: dict = None) -> str:
         """Run the SEC scanner and return a summary of results."""
         prompt = payload.get("prompt", "")
         ticker = payload.get("ticker")
@@ -49,7 +81,6 @@ class AnalystDirector(BaseDirector):
         # Extract ticker from prompt if not explicitly set
         # Handles: "scan ticker NVDA", "sec scan AAPL", "ai washing MSFT"
         if not ticker:
-            import re
             SKIP = {"SEC", "SCAN", "AI", "THE", "FOR", "AND", "RUN", "TICKER",
                     "WATCHLIST", "DO", "A", "AN", "ME", "US", "IS", "IN", "ON"}
             # Look for explicit "ticker SYMBOL" pattern first
@@ -65,32 +96,136 @@ class AnalystDirector(BaseDirector):
 
         watchlist = payload.get("watchlist", False) or "watchlist" in prompt.lower()
 
-        cmd = [str(SEC_SCANNER_VENV)]
-        if ticker and not watchlist:
-            cmd += [ticker.upper()]   # positional arg
-        else:
-            cmd += ["--watchlist"]
+        refresh = payload.get("refresh", False)
+
+        if watchlist:
+            tickers = self._watchlist_tickers(payload)
+            if tickers:
+                return self._run_sharded_scan(tickers, task, refresh)
 
+        try:
+            if ticker and not watchlist:
+                output = self._scan_ticker(ticker.upper(), SEC_SCAN_TIMEOUT, refresh)
+            else:
+                # no ticker list (or no ticker) — let the scanner expand the watchlist (uncached)
+                output = self._run_scanner(["--watchlist"], SEC_SCAN_TIMEOUT)
+        except WorkerTimeout as e:
+            # A long scan that already printed scores is still worth reporting
+            if not self._score_lines(e.partial_output):
+                raise
+            summary = f"{self._summarize(e.partial_output)}\n[partial — {e}]"
+            audit_log(self.name, "sec_scan_partial", summary[:200])
+            return summary
+
+        summary = self._summarize(output)
+        audit_log(self.name, "sec_scan_done", summary[:200])
+        return summary
+
+    def _watchlist_tickers(self, payload: dict) -> list:
+        """Tickers to shard a watchlist scan over: payload["tickers"], else the watchlist file."""
+        tickers = payload.get("tickers")
+        if not tickers and SEC_WATCHLIST_FILE.exists():
+            tickers = [
+                line.split("#", 1)[0].strip()
+                for line in SEC_WATCHLIST_FILE.read_text().splitlines()
+            ]
+        return [t.upper() for t in (tickers or []) if t]
+
+    def _scan_ticker(self, ticker: str, timeout: int, refresh: bool = False) -> str:
+        """Scanner output for one ticker, from the scan cache when fresh enough."""
+        cached = get_sec_scan(ticker)
+        if cached and not refresh and time.time() - cached["scanned_at"] < SEC_CACHE_MAX_AGE:
+            audit_log(self.name, "sec_scan_cached", ticker, result=cached["filing_id"] or "ok")
+            return cached["output"]
+
+        output = self._run_scanner([ticker], timeout)   # positional arg
+        m = ACCESSION_RE.search(output)   # scanner lists the latest filing first
+        filing_id = m.group(0) if m else None
+        if cached and filing_id and filing_id == cached["filing_id"]:
+            audit_log(self.name, "sec_scan_unchanged", ticker, result=filing_id)
+        put_sec_scan(ticker, output, filing_id)
+        return output
+
+    def _run_scanner(self, args: list, timeout: int) -> str:
+        """Run sec-scanner with args and return its stdout.
+
+        Output streams into the task's task_output as it runs. On timeout
+        the WorkerTimeout carries what was printed so far (partial_output).
+        """
+        cmd = [str(SEC_SCANNER_VENV)] + args
         audit_log(self.name, "sec_scan_start", " ".join(cmd))
         print(f"  [analyst] Running SEC scan: {' '.join(cmd)}")
 
         try:
-            result = subprocess.run(
-                cmd,
-                capture_output=True,
-                text=True,
-                timeout=600,
-                cwd=str(SEC_SCANNER_DIR)
+            returncode, stdout, stderr = run_streaming(cmd, timeout, cwd=str(SEC_SCANNER_DIR))
+        except subprocess.TimeoutExpired as e:
+            raise WorkerTimeout(f"SEC scan timed out after {timeout}s", partial_output=e.output or "")
+        if returncode != 0:
+            raise WorkerError(stderr.strip()[:300])
+        return stdout.strip()
+
+    @staticmethod
+    def _score_lines(output: str) -> list:
+        return [l.strip() for l in output.splitlines() if "Score:" in l]
+
+    def _summarize(self, output: str) -> str:
+        """Extract score lines for summary."""
+        lines = self._score_lines(output)
+        summary = "\n".join(lines) if lines else output[-500:]
+        return summary or "Scan complete — no score lines found in output."
+
+    def _run_sharded_scan(self, tickers: list, task: dict = None, refresh: bool = False) -> str:
+        """Scan each ticker as its own subprocess on a bounded pool.
+
+        Tickers with a fresh cached scan are not re-run.
+
+        Partial results are written to the task as each ticker finishes. A
+        ticker that fails or times out is reported, and the others still
+        complete. A ticker that timed out after printing scores contributes
+        those scores, flagged as partial. The final summary lists score lines
+        in watchlist order.
+
+        The whole scan can outlast one lease (about ceil(N / concurrency)
+        ticker timeouts), so the task's lease is renewed as each ticker
+        finishes. If another worker has reclaimed the task meanwhile, the
+        remaining tickers are abandoned.
+        """
+        outputs, errors = {}, {}
+        workers = min(SEC_SCAN_CONCURRENCY, len(tickers))
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="sec-scan") as pool:
+            futures = {
+                # each shard runs in a copy of this context, so its output is captured for this task
+                pool.submit(contextvars.copy_context().run, self._scan_ticker, t, SEC_TICKER_TIMEOUT, refresh): t
+                for t in tickers
+            }
+            for future in as_completed(futures):
+                t = futures[future]
+                try:
+                    outputs[t] = future.result()
+                except WorkerTimeout as e:
+                    if self._score_lines(e.partial_output):
+                        outputs[t] = e.partial_output
+                    errors[t] = str(e)
+                except Exception as e:
+                    errors[t] = str(e)
+                if task is not None:
+                    if not renew_lease(task["id"], task["worker_id"], self.lease_seconds):
+                        for f in futures:
+                            f.cancel()
+                        raise WorkerError("SEC scan abandoned: the task was reclaimed by another worker")
+                    scored = [l for tk in tickers if tk in outputs for l in self._score_lines(outputs[tk])]
+                    progress = f"[{len(outputs | errors)}/{len(tickers)} tickers scanned]"
+                    set_task_progress(task["id"], "\n".join([progress] + scored))
+
+        if not outputs:
+            raise WorkerError("SEC scan failed for every ticker: " +
+                              "; ".join(f"{t}: {e}" for t, e in errors.items())[:300])
+
+        summary = self._summarize("\n".join(outputs[t] for t in tickers if t in outputs))
+        if errors:
+            summary += "\n" + "\n".join(
+                f"{t}: {'partial — ' if t in outputs else 'scan failed — '}{errors[t][:100]}"
+                for t in tickers if t in errors
             )
-            output = result.stdout.strip()
-            if result.returncode != 0:
-                raise RuntimeError(result.stderr.strip()[:300])
-
-            # Extract score lines for summary
-            lines = [l.strip() for l in output.splitlines() if "Score:" in l]
-            summary = "\n".join(lines) if lines else output[-500:]
-            audit_log(self.name, "sec_scan_done", summary[:200])
-            return summary or "Scan complete — no score lines found in output."
-
-        except subprocess.TimeoutExpired:
-            raise RuntimeError("SEC scan timed out after 600s")
+        audit_log(self.name, "sec_scan_done", summary[:200])
+        return summary
@@ -1,38 +1,306 @@
 """Base Director agent class."""
 
+import asyncio
+import contextvars
+import random
+import threading
 import time
-from database import get_pending_tasks, update_task, write_memory
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from database import (claim_tasks, update_task, write_memory, search_memory,
+                      dependency_results, DEFAULT_LEASE_SECONDS)
 from worklog import log_to_worklog
+from workers import aio
+from workers.errors import WorkerTimeout, CommandNotAllowed
+from workers.output import current_task_id
+
+
+@dataclass(frozen=True)
+class RetryPolicy:
+    max_attempts: int          # total runs, including the first
+    base_delay: float = 0.0    # seconds before the first retry, doubled per attempt, with jitter
+    max_delay: float = 0.0
+
+    def delay(self, attempts: int) -> float:
+        """Backoff before the retry that follows attempt number `attempts`."""
+        return self.longest_delay(attempts) * random.uniform(0.5, 1.0)
+
+    def longest_delay(self, attempts: int) -> float:
+        """Upper bound of delay(attempts) — jitter only ever shortens it."""
+        return min(self.max_delay, self.base_delay * 2 ** (attempts - 1))
 
 
 class BaseDirector:
     name: str = "base"
+    # How long a claimed task stays leased before another worker may reclaim it.
+    # Must comfortably exceed the slowest run_task for this director.
+    lease_seconds: int = DEFAULT_LEASE_SECONDS
+    # Longest a task may run under process_pending_async before it is cancelled
+    # (None: just under lease_seconds). Only directors with their own run_task_async are
+    # cut off — see _task_timeout.
+    task_timeout: float = None
+    # Max tasks this director runs at once. Work is I/O-bound subprocess waits,
+    # so threads are enough.
+    concurrency: int = 1
+    # Max tasks in progress at once under process_pending_async. Can be high —
+    # the workers.aio semaphores are what bound real subprocesses. Directors
+    # without their own run_task_async run on threads and are held to concurrency.
+    async_concurrency: int = 16
+    # Relevant past results (from any director) attached to prompts. Off unless
+    # the task's payload has "memory": true (or a director sets attach_memory):
+    # attached memory changes the prompt, and so its prompt-cache key, every
+    # time memory grows, so repeated questions would never hit the cache.
+    attach_memory: bool = False
+    memory_top_k: int = 3
+    # Rough cap on attached memory, in tokens (~4 characters each)
+    memory_token_budget: int = 1000
+    # Retry policy by exception class — the first isinstance match wins
+    retry_policies: tuple = (
+        (CommandNotAllowed, RetryPolicy(max_attempts=1)),   # deterministic; a retry fails the same way
+        (WorkerTimeout, RetryPolicy(max_attempts=3, base_delay=30, max_delay=600)),
+        (Exception, RetryPolicy(max_attempts=2, base_delay=10, max_delay=300)),
+    )
+    # Rough cap on results passed down from the tasks this one depends on
+    dependency_token_budget: int = 3000
+
+    def __init__(self, concurrency: int = None):
+        if concurrency is not None:
+            self.concurrency = max(1, concurrency)
+        self._pool = None
+        self._pool_lock = threading.Lock()
 
     def run_task(self, task: dict) -> str:
         raise NotImplementedError
 
-    def process_pending(self):
-        tasks = get_pending_tasks(self.name)
-        for task in tasks:
-            start = time.time()
-            update_task(task["id"], "running")
-            try:
-                result = self.run_task(task)
-                update_task(task["id"], "done", result)
-                write_memory(self.name, f"task_{task['id']}_result", result)
-                elapsed = (time.time() - start) / 3600
-                log_to_worklog(
-                    project="MultiAgent",
-                    description=f"[{self.name}] {task['task_type']}: {task['payload'][:80]}",
-                    actual_hours=round(elapsed, 3),
-                    task_type="agent"
-                )
-                print(f"  ✓ [{self.name}] Task {task['id']} done")
-            except Exception as e:
-                attempts = task.get("attempts", 0) + 1
-                if attempts >= 2:
-                    update_task(task["id"], "failed", str(e))
-                    print(f"  ✗ [{self.name}] Task {task['id']} FAILED: {e}")
-                else:
-                    update_task(task["id"], "pending")
-                    print(f"  ↻ [{self.name}] Task {task['id']} retry ({attempts}/2)")
+    def prompt_context(self, task: dict, prompt: str, payload: dict = None) -> str:
+        """Context to prepend to a task's prompt: upstream subtask results, then relevant memory."""
+        return "\n\n".join(c for c in (self.dependency_context(task), self.memory_context(prompt, payload)) if c)
+
+    def dependency_context(self, task: dict) -> str:
+        """Results of the subtasks this task depends on, trimmed to dependency_token_budget."""
+        deps = dependency_results(task["id"])
+        if not deps:
+            return ""
+        share = self.dependency_token_budget * 4 // len(deps)
+        pieces = []
+        for d in deps:
+            result = d["result"] or ""
+            if len(result) > share:
+                result = result[:share - 1] + "…"
+            pieces.append(f"[{d['assigned_to']} · {d['prompt'][:80]}]\n{result}")
+        return "Results from the earlier steps of this request:\n\n" + "\n\n".join(pieces)
+
+    def memory_context(self, prompt: str, payload: dict = None) -> str:
+        """Top-k shared-memory results relevant to prompt, trimmed to memory_token_budget."""
+        if not self.memory_top_k or not (payload or {}).get("memory", self.attach_memory):
+            return ""
+        budget = self.memory_token_budget * 4
+        pieces = []
+        for hit in search_memory(prompt, limit=self.memory_top_k):
+            header = f"[{hit['agent']} · {hit['key']} · {hit['created_at'][:16]}]\n"
+            room = budget - len(header)
+            if room < 200:
+                break
+            value = hit["value"] or ""
+            text = header + (value if len(value) <= room else value[:room - 1] + "…")
+            pieces.append(text)
+            budget -= len(text)
+        if not pieces:
+            return ""
+        return "Relevant prior results from the team (use if helpful):\n\n" + "\n\n".join(pieces)
+
+    def process_pending(self, stop: threading.Event = None) -> list:
+        """Claim and run tasks until the queue is empty, or until `stop` is set.
+
+        Up to `concurrency` tasks run at once on a thread pool. Tasks are
+        claimed atomically, so several processes may also call this for the
+        same director without running a task twice. Once `stop` is set no
+        more tasks are claimed; those already running finish.
+
+        Returns one {"id", "status", "latency_s"} dict per task handled.
+        """
+        if self.concurrency == 1:
+            return self._drain(stop)
+        pool = self._executor()
+        futures = [pool.submit(self._drain, stop) for _ in range(self.concurrency)]
+        return [stat for f in futures for stat in f.result()]
+
+    def _executor(self) -> ThreadPoolExecutor:
+        """This director's worker threads, started on first use and kept for its lifetime.
+
+        Reusing the threads across calls (a daemon polls every second) keeps
+        each one's pooled SQLite connection open rather than reconnecting.
+        """
+        with self._pool_lock:
+            if self._pool is None:
+                self._pool = ThreadPoolExecutor(max_workers=self.concurrency,
+                                                thread_name_prefix=f"director-{self.name}")
+            return self._pool
+
+    def close(self):
+        """Stop the worker threads (their thread-local connections go with them).
+
+        A later process_pending starts new ones.
+        """
+        with self._pool_lock:
+            pool, self._pool = self._pool, None
+        if pool is not None:
+            pool.shutdown(wait=True)
+
+    def _drain(self, stop: threading.Event = None) -> list:
+        """Worker loop: claim one task at a time and run it, until the queue is empty or stop is set."""
+        stats = []
+        while stop is None or not stop.is_set():
+            claimed = self._claim()
+            if not claimed:
+                break
+            stats.append(self._run_one(claimed[0]))
+        return stats
+
+    def _claim(self) -> list:
+        """Claim one task. A lease that lapsed (the worker died or overran it) counts as a timeout."""
+        lapsed = self.retry_policy(WorkerTimeout("lease expired"))
+        return claim_tasks(self.name, n=1, lease_seconds=self.lease_seconds,
+                           max_attempts=lapsed.max_attempts)
+
+    def _run_one(self, task: dict) -> dict:
+        start = time.time()
+        token = current_task_id.set(task["id"])   # worker subprocess output is captured for this task
+        try:
+            result = self.run_task(task)
+        except Exception as e:
+            return self._finish(task, start, error=e)
+        finally:
+            current_task_id.reset(token)
+        return self._finish(task, start, result=result)
+
+    def _finish(self, task: dict, start: float, result: str = None, error: Exception = None) -> dict:
+        """Record a task outcome: done, retry or failed. Blocking (DB + WorkLog)."""
+        latency = time.time() - start
+        # only the current claim may record the outcome
+        fence = {"worker_id": task["worker_id"], "attempts": task["attempts"]}
+        if error is None:
+            if not update_task(task["id"], "done", result, **fence):
+                return self._superseded(task, latency)
+            write_memory(self.name, f"task_{task['id']}_result", result)
+            log_to_worklog(
+                project="MultiAgent",
+                description=f"[{self.name}] {task['task_type']}: {task['payload'][:80]}",
+                actual_hours=round(latency / 3600, 3),
+                task_type="agent"
+            )
+            print(f"  ✓ [{self.name}] Task {task['id']} done ({latency:.1f}s)")
+            status = "done"
+        else:
+            attempts = task["attempts"]   # claim_tasks counted this run
+            policy = self.retry_policy(error)
+            if attempts >= policy.max_attempts:
+                if not update_task(task["id"], "failed", str(error), **fence):
+                    return self._superseded(task, latency)
+                print(f"  ✗ [{self.name}] Task {task['id']} FAILED after {latency:.1f}s: {error}")
+                status = "failed"
+            else:
+                delay = policy.delay(attempts)
+                if not update_task(task["id"], "pending", f"Retry scheduled after error: {error}",
+                                   not_before=datetime.now() + timedelta(seconds=delay), **fence):
+                    return self._superseded(task, latency)
+                print(f"  ↻ [{self.name}] Task {task['id']} retry ({attempts}/{policy.max_attempts}) "
+                      f"in {delay:.0f}s after {latency:.1f}s: {error}")
+                status = "retry"
+        return {"id": task["id"], "status": status, "latency_s": round(latency, 3)}
+
+    def _superseded(self, task: dict, latency: float) -> dict:
+        """The task was reclaimed (our lease expired) or finalized elsewhere — drop this outcome."""
+        print(f"  ⚠ [{self.name}] Task {task['id']} no longer held by this worker after {latency:.1f}s "
+              f"— outcome discarded")
+        return {"id": task["id"], "status": "superseded", "latency_s": round(latency, 3)}
+
+    def retry_budget(self) -> float:
+        """Longest a task can take to reach a final status, retries included.
+
+        Each attempt is bounded by the lease (a stalled one is reclaimed once
+        it lapses) and each retry waits at most its longest backoff. The most
+        generous policy sets the budget.
+        """
+        return max(
+            policy.max_attempts * self.lease_seconds
+            + sum(policy.longest_delay(n) for n in range(1, policy.max_attempts))
+            for _, policy in self.retry_policies
+        )
+
+    def retry_policy(self, error: Exception) -> RetryPolicy:
+        for cls, policy in self.retry_policies:
+            if isinstance(error, cls):
+                return policy
+        return RetryPolicy(max_attempts=1)
+
+    # ── Async path (daemon --async) ──────────────────────────────────────
+
+    async def run_task_async(self, task: dict) -> str:
+        """Async run_task. Directors built on the async workers override this.
+
+        The default runs run_task on this director's own threads (see
+        _executor), not the loop's default executor: every director's
+        claims and results go through that one, and a backlog of slow
+        thread-backed tasks must not hold all of it. A thread can't be
+        cancelled, so such tasks get no overall timeout; the workers' own
+        subprocess timeouts bound them instead.
+        """
+        context = contextvars.copy_context()   # keeps current_task_id, as to_thread would
+        return await asyncio.get_running_loop().run_in_executor(
+            self._executor(), context.run, self.run_task, task)
+
+    async def process_pending_async(self, max_in_flight: int = None, timeout: float = None,
+                                    stop: asyncio.Event = None) -> list:
+        """Claim and run tasks on the current event loop until the queue is empty, or until `stop` is set.
+
+        Up to max_in_flight tasks (default async_concurrency) are in progress
+        at once. Actual subprocess concurrency is capped separately by the
+        workers.aio semaphores. A task that runs past `timeout` (default: the
+        director's task_timeout) is cancelled, which kills its subprocess
+        group, and is then retried or failed like any other error. Once
+        `stop` is set no more tasks are claimed; those in progress finish.
+        """
+        timeout = self._task_timeout(timeout)
+
+        async def worker():
+            stats = []
+            while stop is None or not stop.is_set():
+                claimed = await asyncio.to_thread(self._claim)
+                if not claimed:
+                    break
+                stats.append(await self._run_one_async(claimed[0], timeout))
+            return stats
+
+        in_flight = max_in_flight or self.async_concurrency
+        if self._thread_backed():
+            in_flight = min(in_flight, self.concurrency)   # no more than it has threads
+        results = await asyncio.gather(*(worker() for _ in range(in_flight)))
+        return [stat for r in results for stat in r]
+
+    def _thread_backed(self) -> bool:
+        """Whether process_pending_async runs this director's tasks on threads (the default run_task_async)."""
+        return type(self).run_task_async is BaseDirector.run_task_async
+
+    def _task_timeout(self, timeout: float = None) -> float | None:
+        """Overall timeout for one async task, or None if it can't be enforced."""
+        if self._thread_backed():
+            # Cancelling to_thread abandons the thread but its subprocess keeps
+            # running; a retry would then start a second copy of the same work.
+            return None
+        # default: give up a little before the lease lapses and another worker may reclaim it
+        return timeout or self.task_timeout or self.lease_seconds * 0.9
+
+    async def _run_one_async(self, task: dict, timeout: float = None) -> dict:
+        aio.slot_owner.set(self.name)   # fair share of the worker slots (per asyncio task)
+        current_task_id.set(task["id"])
+        start = time.time()
+        try:
+            result = await asyncio.wait_for(self.run_task_async(task), timeout)
+        except asyncio.TimeoutError:
+            error = WorkerTimeout(f"Task timed out after {timeout}s")
+            return await asyncio.to_thread(self._finish, task, start, None, error)
+        except Exception as e:
+            return await asyncio.to_thread(self._finish, task, start, None, e)
+        return await asyncio.to_thread(self._finish, task, start, result)
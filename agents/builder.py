@@ -2,15 +2,25 @@
 
 import json
 from agents.base import BaseDirector
-from workers.claude_worker import run as claude_run
+from workers.claude_worker import run as claude_run, run_async as claude_run_async
 
 
 class BuilderDirector(BaseDirector):
     name = "builder"
+    concurrency = 2
 
-    def run_task(self, task: dict) -> str:
+    def build_prompt(self, task: dict) -> tuple[str, bool]:
+        """Return (full_prompt, use_cache) for a task."""
         payload = json.loads(task["payload"]) if task["payload"] else {}
         prompt = payload.get("prompt", "")
-        context = payload.get("context", "")
+        context = "\n\n".join(c for c in (self.prompt_context(task, prompt, payload), payload.get("context", "")) if c)
         full_prompt = f"{context}\n\n{prompt}".strip() if context else prompt
-        return claude_run(full_prompt)
+        return full_prompt, payload.get("cache", True)
+
+    def run_task(self, task: dict) -> str:
+        full_prompt, cache = self.build_prompt(task)
+        return claude_run(full_prompt, cache=cache)
+
+    async def run_task_async(self, task: dict) -> str:
+        full_prompt, cache = self.build_prompt(task)
+        return await claude_run_async(full_prompt, cache=cache)
@@ -2,14 +2,27 @@
 
 import json
 from agents.base import BaseDirector
-from workers.claude_worker import run as claude_run
+from workers.claude_worker import run as claude_run, run_async as claude_run_async
 
 
 class ResearcherDirector(BaseDirector):
     name = "researcher"
+    concurrency = 3
 
-    def run_task(self, task: dict) -> str:
+    def build_prompt(self, task: dict) -> tuple[str, bool]:
+        """Return (full_prompt, use_cache) for a task."""
         payload = json.loads(task["payload"]) if task["payload"] else {}
         prompt = payload.get("prompt", "")
         full_prompt = f"Research task: {prompt}\n\nProvide a clear, factual summary with specific details. Be concise."
-        return claude_run(full_prompt)
+        context = self.prompt_context(task, prompt, payload)
+        if context:
+            full_prompt = f"{context}\n\n{full_prompt}"
+        return full_prompt, payload.get("cache", True)
+
+    def run_task(self, task: dict) -> str:
+        full_prompt, cache = self.build_prompt(task)
+        return claude_run(full_prompt, cache=cache)
+
+    async def run_task_async(self, task: dict) -> str:
+        full_prompt, cache = self.build_prompt(task)
+        return await claude_run_async(full_prompt, cache=cache)
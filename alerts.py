@@ -2,23 +2,39 @@
 
 Fires structured alerts when tasks fail repeatedly or stall.
 Alert JSONLines are drained by the heartbeat agent → Discord.
+
+Alerts are recorded in the `alerts` table, which is the source of truth for
+GET /alerts and for cursor-based drains. A repeat of the same
+(task_id, reason) inside ALERT_COOLDOWN_SECONDS is counted on the original
+alert and not fired again.
 """
 
 import json
 from pathlib import Path
 from datetime import datetime
+from database import add_event, record_alert, recent_alerts, alerts_after_cursor, ack_alerts
 
 WORKLOG_NOTIFY = Path.home() / ".openclaw" / "worklog-notify.jsonl"
 ALERTS_LOG = Path(__file__).parent / "alerts.log"
 
+# Same task + same reason within this window is a duplicate
+ALERT_COOLDOWN_SECONDS = 3600
+
 
-def fire_alert(task_id: int, reason: str, attempts: int) -> None:
-    """Append an agent_alert to the worklog-notify drain and alerts.log."""
+def fire_alert(task_id: int, reason: str, attempts: int) -> bool:
+    """Record an alert and append it to the worklog-notify drain and alerts.log.
+
+    Returns False if it was suppressed as a duplicate within the cooldown.
+    """
     ts = datetime.now().isoformat(timespec="seconds")
+    alert_id = record_alert(task_id, reason, attempts, ts, ALERT_COOLDOWN_SECONDS)
+    if alert_id is None:
+        return False
 
     # --- JSONLines entry (consumed by heartbeat → Discord) ---
     entry = {
         "type": "agent_alert",
+        "id": alert_id,
         "task_id": task_id,
         "reason": reason,
         "attempts": attempts,
@@ -28,8 +44,55 @@ def fire_alert(task_id: int, reason: str, attempts: int) -> None:
     with WORKLOG_NOTIFY.open("a", encoding="utf-8") as f:
         f.write(json.dumps(entry) + "\n")
 
-    # --- Plain-text log (served by GET /alerts) ---
-    line = f"[{ts}] ALERT task={task_id} attempts={attempts} reason={reason}"
+    # --- Plain-text log (human-readable history) ---
     ALERTS_LOG.parent.mkdir(parents=True, exist_ok=True)
     with ALERTS_LOG.open("a", encoding="utf-8") as f:
-        f.write(line + "\n")
+        f.write(format_alert(entry) + "\n")
+
+    # --- Change feed (pushed by GET /api/stream) ---
+    add_event("alert", task_id=task_id, detail=json.dumps({"reason": reason, "attempts": attempts}))
+    return True
+
+
+def format_alert(alert: dict) -> str:
+    """The one-line alerts.log form of an alert."""
+    return f"[{alert['ts']}] ALERT task={alert['task_id']} attempts={alert['attempts']} reason={alert['reason']}"
+
+
+def latest_alerts(n: int = 20) -> list:
+    """Last n alerts as alerts.log-style lines, oldest first (served by GET /alerts)."""
+    return [format_alert(a) for a in recent_alerts(n)]
+
+
+def drain(consumer: str, limit: int = 100) -> list:
+    """Alerts `consumer` hasn't acked yet. Call ack(consumer, alerts[-1]["id"]) once delivered."""
+    return alerts_after_cursor(consumer, limit)
+
+
+def ack(consumer: str, last_id: int) -> None:
+    ack_alerts(consumer, last_id)
+
+
+def read_notify(offset: int = 0) -> tuple[list, int]:
+    """Read worklog-notify.jsonl entries appended after byte `offset`.
+
+    Returns (entries, new_offset). Store new_offset between polls so each
+    drain reads only new lines. A trailing partial line is left for the
+    next call.
+    """
+    if not WORKLOG_NOTIFY.exists():
+        return [], 0
+    with WORKLOG_NOTIFY.open("rb") as f:
+        f.seek(0, 2)
+        if offset > f.tell():   # file was truncated/replaced — start over
+            offset = 0
+        f.seek(offset)
+        data = f.read()
+    complete = data[:data.rfind(b"\n") + 1]
+    entries = []
+    for line in complete.splitlines():
+        try:
+            entries.append(json.loads(line))
+        except ValueError:
+            continue
+    return entries, offset + len(complete)
@@ -1,8 +1,17 @@
 """Multiagent status API — read-only FastAPI endpoint for Neo HQ dashboard."""
 
-from fastapi import FastAPI
+import asyncio
+import json
+import threading
+import time
+from fastapi import FastAPI, HTTPException, Request
 from fastapi.middleware.cors import CORSMiddleware
-from database import init_db, get_connection
+from fastapi.responses import StreamingResponse
+from database import (init_db, get_connection, prompt_cache_stats, task_counts, list_tasks,
+                      latest_event_id, wait_for_events, wait_for_change, get_task, task_output,
+                      FINAL_STATUSES)
+from alerts import latest_alerts
+from audit import tail as audit_tail
 from datetime import datetime, timezone
 
 app = FastAPI(title="MultiAgent Status API")
@@ -20,67 +29,278 @@ def startup():
     init_db()
 
 
+DIRECTOR_NAMES = ["builder", "researcher", "analyst"]
+# Parent tasks of compound requests (see database.enqueue_dag). Their work is
+# counted through their subtasks, so they are reported apart from the totals.
+COMPOUND_OWNER = "neo"
+
+# Many dashboard tabs refresh at once — serve them one snapshot for this long
+STATUS_CACHE_SECONDS = 2.0
+_status_cache = {"at": 0.0, "body": None}
+_status_lock = threading.Lock()
+
+
 @app.get("/api/status")
 def agent_status():
-    """Return task counts and recent activity for Neo HQ dashboard."""
-    with get_connection() as conn:
-        rows = conn.execute("SELECT status, assigned_to, created_at, result FROM tasks ORDER BY id DESC LIMIT 100").fetchall()
+    """Return all-time task counts and recent activity for Neo HQ dashboard."""
+    with _status_lock:
+        if _status_cache["body"] is None or time.monotonic() - _status_cache["at"] > STATUS_CACHE_SECONDS:
+            _status_cache["body"] = _build_status()
+            _status_cache["at"] = time.monotonic()
+        return _status_cache["body"]
+
 
-    tasks = [dict(r) for r in rows]
+def _build_status() -> dict:
+    counts = task_counts()
+    compound = counts.pop(COMPOUND_OWNER, {})
+    with get_connection() as conn:
+        last = conn.execute(
+            "SELECT assigned_to, status, created_at FROM tasks ORDER BY id DESC LIMIT 1"
+        ).fetchone()
 
-    total     = len(tasks)
-    done      = sum(1 for t in tasks if t["status"] == "done")
-    failed    = sum(1 for t in tasks if t["status"] == "failed")
-    pending   = sum(1 for t in tasks if t["status"] == "pending")
-    running   = sum(1 for t in tasks if t["status"] == "running")
+    def total(status: str) -> int:
+        return sum(by_status.get(status, 0) for by_status in counts.values())
 
     # Per-agent counts
     agents = {}
-    for name in ["builder", "researcher", "analyst"]:
-        agent_tasks = [t for t in tasks if t["assigned_to"] == name]
+    for name in DIRECTOR_NAMES + sorted(set(counts) - set(DIRECTOR_NAMES)):
+        by_status = counts.get(name, {})
         agents[name] = {
-            "total": len(agent_tasks),
-            "done": sum(1 for t in agent_tasks if t["status"] == "done"),
-            "failed": sum(1 for t in agent_tasks if t["status"] == "failed"),
+            "total": sum(by_status.values()),
+            "done": by_status.get("done", 0),
+            "failed": by_status.get("failed", 0),
+            "pending": by_status.get("pending", 0),
+            "running": by_status.get("running", 0),
         }
 
-    last = tasks[0] if tasks else None
-
     return {
-        "total": total,
-        "done": done,
-        "failed": failed,
-        "pending": pending,
-        "running": running,
+        "total": sum(a["total"] for a in agents.values()),
+        "done": total("done"),
+        "failed": total("failed"),
+        "pending": total("pending"),
+        "running": total("running"),
         "agents": agents,
-        "last_task": {
-            "assigned_to": last["assigned_to"],
-            "status": last["status"],
-            "created_at": last["created_at"],
-        } if last else None,
+        "compound_requests": {
+            "total": sum(compound.values()),
+            "done": compound.get("done", 0),
+            "failed": compound.get("failed", 0),
+            "waiting": compound.get("waiting", 0),
+        },
+        "last_task": dict(last) if last else None,
+        "prompt_cache": prompt_cache_stats(),
         "checked_at": datetime.now(timezone.utc).isoformat(),
     }
 
 
 @app.get("/api/recent")
-def recent_tasks(limit: int = 10):
-    """Return recent tasks for activity feed."""
-    with get_connection() as conn:
-        rows = conn.execute(
-            "SELECT * FROM tasks ORDER BY id DESC LIMIT ?", (min(limit, 50),)
-        ).fetchall()
-    return [dict(r) for r in rows]
+def recent_tasks(limit: int = 10, before_id: int = None, include_result: bool = True):
+    """Return recent tasks for activity feed.
+
+    Page backwards with ?before_id=<last id seen>; ?include_result=false
+    drops the result bodies.
+    """
+    return list_tasks(min(limit, 50), before_id=before_id, include_result=include_result)
+
+
+# Comment line sent on an idle stream so proxies don't drop the connection
+STREAM_KEEPALIVE_SECONDS = 15
+
+
+class _DbSignal:
+    """Wakes waiting requests when something new lands in the database.
+
+    One daemon thread per process blocks in _poll (a subclass's database
+    wait) and publishes the newest value it saw to the event loop.
+    Handlers wait for it in asyncio and only read the database (a quick
+    indexed read on a worker thread) when there is something new for them.
+    A long-polling or streaming client therefore holds no threadpool thread.
+    """
+
+    def __init__(self):
+        self.latest = 0
+        self._changed = None
+        self._loop = None
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def _poll(self) -> int | None:
+        """Block until something new, then return the new latest value (None on timeout). Watcher thread only."""
+        raise NotImplementedError
+
+    def _ensure_watcher(self):
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            if self._loop is not loop:   # first use, or a new loop (e.g. a test client)
+                self._loop, self._changed = loop, asyncio.Event()
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._watch, name=type(self).__name__, daemon=True)
+                self._thread.start()
+
+    def _watch(self):
+        while True:
+            try:
+                latest = self._poll()
+            except Exception:
+                time.sleep(1.0)   # DB briefly unavailable — keep watching
+                continue
+            if latest is None:
+                continue
+            try:
+                self._loop.call_soon_threadsafe(self._publish, latest)
+            except RuntimeError:
+                pass   # that loop has closed; the next subscriber brings a new one
+
+    def _publish(self, latest: int):
+        self.latest = max(self.latest, latest)
+        changed, self._changed = self._changed, asyncio.Event()
+        changed.set()
+
+    async def wait(self, after: int, timeout: float) -> bool:
+        """True once latest > after, False after timeout seconds."""
+        self._ensure_watcher()
+        deadline = time.monotonic() + timeout
+        while self.latest <= after:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return False
+            try:
+                await asyncio.wait_for(self._changed.wait(), remaining)
+            except asyncio.TimeoutError:
+                return False
+        return True
+
+
+class _EventSignal(_DbSignal):
+    """The newest events-table id, for /api/stream."""
+
+    def __init__(self):
+        super().__init__()
+        self._cursor = None
+
+    def _poll(self) -> int | None:
+        if self._cursor is None:
+            self._cursor = latest_event_id()
+        else:
+            events = wait_for_events(self._cursor, timeout=STREAM_KEEPALIVE_SECONDS)
+            if not events:
+                return None
+            self._cursor = events[-1]["id"]
+        return self._cursor
+
+
+class _ChangeSignal(_DbSignal):
+    """A count of commits to any table, for ?wait= handlers watching one task.
+
+    Task output adds no event, so those handlers can't use _EventSignal.
+    Read `latest` before reading the database, then wait(seen, ...): a
+    commit in between wakes the waiter at once rather than being missed.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self._version = None
+        self._commits = 0
+
+    def _poll(self) -> int | None:
+        version = wait_for_change(self._version, timeout=STREAM_KEEPALIVE_SECONDS)
+        if version == self._version:
+            return None
+        self._version = version
+        self._commits += 1
+        return self._commits
+
+
+_event_signal = _EventSignal()
+_change_signal = _ChangeSignal()
+
+
+@app.get("/api/stream")
+async def event_stream(request: Request, after: int = None):
+    """Server-Sent Events feed of task state transitions and alerts.
+
+    Each event's SSE id is its cursor. Reconnecting clients resume via the
+    Last-Event-ID header (sent automatically by EventSource) or ?after=<id>.
+    Without either, the stream starts at new events only.
+    """
+    cursor = after
+    if cursor is None and request.headers.get("last-event-id", "").isdigit():
+        cursor = int(request.headers["last-event-id"])
+    if cursor is None:
+        cursor = await asyncio.to_thread(latest_event_id)
+
+    async def stream(cursor: int):
+        yield "retry: 3000\n\n"
+        while True:
+            # a resuming client may be behind the signal — read before waiting
+            events = await asyncio.to_thread(wait_for_events, cursor, 0)
+            if not events and not await _event_signal.wait(cursor, STREAM_KEEPALIVE_SECONDS):
+                yield ": keepalive\n\n"
+            for e in events:
+                cursor = e["id"]
+                yield f"id: {e['id']}\nevent: {e['kind']}\ndata: {json.dumps(e)}\n\n"
+
+    return StreamingResponse(stream(cursor), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+
+@app.get("/api/tasks/{task_id}")
+async def task_detail(task_id: int, wait: float = 0):
+    """Return one task. With ?wait=N, wait up to N seconds (max 60) for it to finish."""
+    deadline = time.monotonic() + max(0.0, min(wait, 60.0))
+    while True:
+        seen = _change_signal.latest
+        task = await asyncio.to_thread(get_task, task_id)
+        if task is None:
+            raise HTTPException(status_code=404, detail="Task not found")
+        remaining = deadline - time.monotonic()
+        if (task["status"] in FINAL_STATUSES or remaining <= 0
+                or not await _change_signal.wait(seen, remaining)):
+            return task
+
+
+@app.get("/api/tasks/{task_id}/output")
+async def task_output_chunks(task_id: int, after: int = 0, wait: float = 0, limit: int = 500):
+    """Captured subprocess output of a task after chunk id `after`, oldest first.
+
+    With ?wait=N, wait up to N seconds (max 60) for new output. Pass the
+    returned `next` as `after` to follow a running task.
+    """
+    limit = max(1, min(limit, 500))
+    deadline = time.monotonic() + max(0.0, min(wait, 60.0))
+    while True:
+        seen = _change_signal.latest
+        task, chunks = await asyncio.to_thread(_output_page, task_id, after, limit)
+        if task is None:
+            raise HTTPException(status_code=404, detail="Task not found")
+        remaining = deadline - time.monotonic()
+        if (chunks or task["status"] in FINAL_STATUSES or remaining <= 0
+                or not await _change_signal.wait(seen, remaining)):
+            break
+    return {
+        "task_id": task_id,
+        "status": task["status"],
+        "chunks": chunks,
+        "next": chunks[-1]["id"] if chunks else after,
+    }
+
+
+def _output_page(task_id: int, after: int, limit: int) -> tuple[dict | None, list]:
+    task = get_task(task_id)
+    return task, task_output(task_id, after, limit) if task else []
+
+
+@app.get("/api/audit")
+def audit_entries(limit: int = 50, agent: str = None, action: str = None, task_id: int = None,
+                  since: str = None, until: str = None):
+    """Return the latest audit entries (oldest first), filtered like `main.py --audit`."""
+    return audit_tail(min(limit, 500), agent=agent, action=action, task_id=task_id,
+                      since=since, until=until)
 
 
 @app.get("/alerts")
-def get_alerts():
-    """Return last 20 lines from alerts.log as a JSON array of strings."""
-    from pathlib import Path
-    log_path = Path(__file__).parent / "alerts.log"
-    if not log_path.exists():
-        return []
-    lines = log_path.read_text(encoding="utf-8").strip().splitlines()
-    return lines[-20:]
+def get_alerts(limit: int = 20):
+    """Return the latest alerts (default 20) as a JSON array of alerts.log-style lines."""
+    return latest_alerts(min(limit, 200))
 
 
 if __name__ == "__main__":
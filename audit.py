@@ -1,19 +1,33 @@
-"""Audit logger — writes every agent action to audit.log."""
+"""Audit logger — writes every agent action to audit.log.
 
+log() only enqueues; a background thread batches entries into one write
+per flush. The file is rotated by size into gzip archives, each written as
+a run of small gzip members with a sidecar index of their offsets. tail()
+reads backwards from the end, the archives one member at a time, so its
+cost grows with the entries returned, not with the file size.
+"""
+
+import atexit
+import fcntl
+import gzip
 import json
-import logging
+import os
+import queue
+import threading
 from datetime import datetime, timezone
 from pathlib import Path
 
 LOG_PATH = Path(__file__).parent / "audit.log"
 
-# Set up a dedicated file logger
-_logger = logging.getLogger("sayvdo.audit")
-_logger.setLevel(logging.INFO)
-_handler = logging.FileHandler(LOG_PATH)
-_handler.setFormatter(logging.Formatter("%(message)s"))
-if not _logger.handlers:
-    _logger.addHandler(_handler)
+MAX_BYTES = 10 * 1024 * 1024     # rotate audit.log past this size
+BACKUP_COUNT = 10                # gzip archives kept: audit.log.1.gz (newest) .. audit.log.N.gz
+MEMBER_BYTES = 256 * 1024        # log bytes per gzip member of an archive — what tail() inflates at once
+FLUSH_INTERVAL = 0.5             # seconds the writer waits to fill a batch
+BATCH_MAX = 500                  # entries per write
+
+_queue: queue.Queue = queue.Queue()
+_writer = None
+_writer_lock = threading.Lock()
 
 
 def log(agent: str, action: str, detail: str, result: str = "ok", task_id: int = None):
@@ -27,4 +41,175 @@ def log(agent: str, action: str, detail: str, result: str = "ok", task_id: int =
     }
     if task_id is not None:
         entry["task_id"] = task_id
-    _logger.info(json.dumps(entry))
+    _ensure_writer()
+    _queue.put(json.dumps(entry) + "\n")
+
+
+def flush(timeout: float = 5.0):
+    """Block until everything logged so far is on disk."""
+    if _writer is None:
+        return
+    done = threading.Event()
+    _queue.put(done)
+    done.wait(timeout)
+
+
+def _ensure_writer():
+    global _writer
+    if _writer is not None:
+        return
+    with _writer_lock:
+        if _writer is None:
+            _writer = threading.Thread(target=_write_loop, name="audit-writer", daemon=True)
+            _writer.start()
+            atexit.register(flush)
+
+
+def _write_loop():
+    while True:
+        batch, markers = [], []
+        item = _queue.get()
+        while True:
+            if isinstance(item, threading.Event):
+                markers.append(item)
+            else:
+                batch.append(item)
+            if len(batch) >= BATCH_MAX or markers:
+                break
+            try:
+                item = _queue.get(timeout=FLUSH_INTERVAL)
+            except queue.Empty:
+                break
+        if batch:
+            try:
+                _write_batch("".join(batch))
+            except OSError:
+                pass   # auditing must never take down the caller's process
+        for m in markers:
+            m.set()
+
+
+def _write_batch(data: str):
+    # Several processes (CLI, daemon, API) share the file; a sidecar lock keeps
+    # rotation and appends from interleaving.
+    with open(str(LOG_PATH) + ".lock", "w") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        try:
+            if LOG_PATH.exists() and LOG_PATH.stat().st_size + len(data) > MAX_BYTES:
+                _rotate()
+            with LOG_PATH.open("a", encoding="utf-8") as f:
+                f.write(data)
+        finally:
+            fcntl.flock(lock, fcntl.LOCK_UN)
+
+
+def _archive(n: int) -> Path:
+    return LOG_PATH.with_name(f"{LOG_PATH.name}.{n}.gz")
+
+
+def _index(n: int) -> Path:
+    """Sidecar of an archive: a JSON list of its gzip members' byte offsets."""
+    return LOG_PATH.with_name(f"{LOG_PATH.name}.{n}.gz.idx")
+
+
+def _rotate():
+    """audit.log → audit.log.1.gz, shifting older archives up and dropping the oldest.
+
+    The archive is a series of gzip members of about MEMBER_BYTES each,
+    split on line boundaries. It is still one valid .gz file (zcat reads
+    it whole), and the index lets tail() inflate one member at a time.
+    """
+    _archive(BACKUP_COUNT).unlink(missing_ok=True)
+    _index(BACKUP_COUNT).unlink(missing_ok=True)
+    for n in range(BACKUP_COUNT - 1, 0, -1):
+        for path, shifted in ((_archive(n), _archive(n + 1)), (_index(n), _index(n + 1))):
+            if path.exists():
+                os.replace(path, shifted)
+    offsets = []
+    with LOG_PATH.open("rb") as src, _archive(1).open("wb") as dst:
+        while block := src.read(MEMBER_BYTES):
+            offsets.append(dst.tell())
+            dst.write(gzip.compress(block + src.readline()))   # finish the line the block cut
+    _index(1).write_text(json.dumps(offsets))
+    LOG_PATH.unlink()
+
+
+# ── Reading ──────────────────────────────────────────────────────────────
+
+def _reverse_lines(path: Path, block_size: int = 64 * 1024):
+    """Yield the lines of a file last-first, reading fixed-size blocks from the end."""
+    with path.open("rb") as f:
+        f.seek(0, os.SEEK_END)
+        pos = f.tell()
+        tail = b""
+        while pos > 0:
+            step = min(block_size, pos)
+            pos -= step
+            f.seek(pos)
+            chunk = f.read(step) + tail
+            lines = chunk.split(b"\n")
+            tail = lines.pop(0)   # may be a partial line — completed by the next block
+            for line in reversed(lines):
+                if line.strip():
+                    yield line.decode("utf-8", errors="replace")
+        if tail.strip():
+            yield tail.decode("utf-8", errors="replace")
+
+
+def _archive_lines(n: int):
+    """Yield the lines of archive n last-first, inflating one gzip member at a time."""
+    try:
+        offsets = json.loads(_index(n).read_text())
+    except (OSError, ValueError):
+        offsets = [0]   # no index: inflate the archive as a whole
+    with _archive(n).open("rb") as f:
+        end = f.seek(0, os.SEEK_END)
+        for start in reversed(offsets):
+            f.seek(start)
+            lines = gzip.decompress(f.read(end - start)).split(b"\n")
+            end = start
+            for line in reversed(lines):
+                if line.strip():
+                    yield line.decode("utf-8", errors="replace")
+
+
+def tail(n: int = 20, agent: str = None, action: str = None, task_id: int = None,
+         since: str = None, until: str = None) -> list:
+    """Return the last n entries matching every given filter, oldest first.
+
+    since/until are ISO-8601 timestamps compared against the entry's ts.
+    Entries are appended in time order, so the scan stops at the first entry
+    older than `since`. Rotated archives are only opened when the live file
+    does not hold enough matches. Unparseable lines come back as {"raw": line}.
+    """
+    flush()
+    matches = []
+    for i in range(BACKUP_COUNT + 1):   # the live file, then the archives newest first
+        path = _archive(i) if i else LOG_PATH
+        if not path.exists():
+            continue
+        lines = _archive_lines(i) if i else _reverse_lines(path)
+        for line in lines:
+            try:
+                e = json.loads(line)
+            except ValueError:
+                if not (agent or action or task_id is not None or since or until):
+                    matches.append({"raw": line})
+                    if len(matches) >= n:
+                        return matches[::-1]
+                continue
+            ts = e.get("ts", "")
+            if since and ts < since:
+                return matches[::-1]
+            if until and ts > until:
+                continue
+            if agent and e.get("agent") != agent:
+                continue
+            if action and e.get("action") != action:
+                continue
+            if task_id is not None and e.get("task_id") != task_id:
+                continue
+            matches.append(e)
+            if len(matches) >= n:
+                return matches[::-1]
+    return matches[::-1]
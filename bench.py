@@ -0,0 +1,213 @@
+"""Micro-benchmarks for the multi-agent hot paths.
+
+Runs against a throwaway database in a temp directory — never multiagent.db.
+
+    python bench.py db                       # 10k / 100k / 1M rows
+    python bench.py db --rows 10000 100000
+    python bench.py storage                  # DB size / list latency, plain vs compressed bodies
+    python bench.py route                    # routing 5k prompts: per-keyword loops vs compiled router
+"""
+
+import argparse
+import json
+import random
+import statistics
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import database
+
+DIRECTORS = ["builder", "researcher", "analyst"]
+
+
+def _timeit(fn, repeat: int = 50) -> float:
+    """Median wall time of fn() in milliseconds."""
+    samples = []
+    for _ in range(repeat):
+        t = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - t) * 1000)
+    return statistics.median(samples)
+
+
+def _use_temp_db(tmp: str, name: str):
+    database.close_connection()
+    database.DB_PATH = Path(tmp) / name
+    return database.get_connection()
+
+
+def _seed_tasks_and_memory(conn, rows: int):
+    """Mostly finished history with a thin slice of pending work, like a long-lived queue."""
+    rng = random.Random(rows)
+    statuses = ["done"] * 90 + ["failed"] * 8 + ["pending"] * 2
+    with conn:
+        conn.executemany(
+            "INSERT INTO tasks (created_at, assigned_to, task_type, payload, status, result) "
+            "VALUES (datetime('now', ?), ?, 'user_request', ?, ?, ?)",
+            ((f"-{rows - i} seconds", rng.choice(DIRECTORS), f'{{"prompt": "task {i}"}}',
+              rng.choice(statuses), f"result {i}") for i in range(rows))
+        )
+        conn.executemany(
+            "INSERT INTO memory (agent, key, value, created_at) VALUES (?, ?, ?, datetime('now', ?))",
+            ((rng.choice(DIRECTORS), f"task_{i % (rows // 4 or 1)}_result", f"value {i}",
+              f"-{rows - i} seconds") for i in range(rows))
+        )
+
+
+def bench_db(sizes: list[int]):
+    queries = {
+        # What an idle director runs every poll: a write transaction that finds nothing due
+        "claim (idle)": lambda c: database.claim_tasks("researcher"),
+        "read_memory": lambda c: c.execute(
+            "SELECT value FROM memory WHERE agent = ? AND key = ? "
+            "ORDER BY created_at DESC LIMIT 1", ("builder", "task_42_result")).fetchone(),
+    }
+    print(f"{'rows':>10}  {'query':<14} {'no index (ms)':>14} {'indexed (ms)':>13} {'speedup':>8}")
+    print("-" * 64)
+    with tempfile.TemporaryDirectory() as tmp:
+        for rows in sizes:
+            conn = _use_temp_db(tmp, f"bench_{rows}.db")
+            _seed_tasks_and_memory(conn, rows)
+            with conn:   # keep the queue's pending slice, but not due, so each claim finds nothing
+                conn.execute("UPDATE tasks SET not_before = '9999-12-31' WHERE status = 'pending'")
+            conn.execute("ANALYZE")
+            indexed = {name: _timeit(lambda: q(conn)) for name, q in queries.items()}
+            with conn:
+                conn.execute("DROP INDEX idx_tasks_queue")
+                conn.execute("DROP INDEX idx_memory_lookup")
+            repeat = 5 if rows >= 1_000_000 else 20
+            scan = {name: _timeit(lambda: q(conn), repeat) for name, q in queries.items()}
+            for name in queries:
+                print(f"{rows:>10,}  {name:<14} {scan[name]:>14.3f} {indexed[name]:>13.3f} "
+                      f"{scan[name] / indexed[name]:>7.0f}x")
+            database.close_connection()
+
+
+_WORDS = ("the filing revenue guidance margin quarter risk factor endpoint request handler "
+          "database index latency agent director memory result summary analysis build test "
+          "error retry timeout deploy config module function return value growth segment").split()
+
+
+def _fake_output(rng: random.Random) -> str:
+    """A Claude-style markdown answer: a heading, bullets, sometimes a code block. ~0.3–30 KB."""
+    target = int(rng.lognormvariate(8, 1.1))
+    parts = [f"## {' '.join(rng.choices(_WORDS, k=4)).title()}\n"]
+    while sum(map(len, parts)) < target:
+        if rng.random() < 0.15:
+            parts.append("```python\n" + "\n".join(
+                f"def {rng.choice(_WORDS)}_{i}(x):\n    return x.{rng.choice(_WORDS)}()" for i in range(5)
+            ) + "\n```\n")
+        else:
+            parts.append(f"- **{rng.choice(_WORDS).title()}**: " + " ".join(rng.choices(_WORDS, k=rng.randint(12, 40))) + ".\n")
+    return "".join(parts)
+
+
+def bench_storage(rows: int):
+    print(f"{rows:,} finished tasks, bodies ~0.3–30 KB; COMPRESS_MIN_BYTES={database.COMPRESS_MIN_BYTES}")
+    print(f"{'mode':<12} {'db size (MB)':>12} {'list 20 (ms)':>13} {'list 20, no result (ms)':>24} {'get_task (ms)':>14}")
+    print("-" * 80)
+    default_threshold = database.COMPRESS_MIN_BYTES
+    with tempfile.TemporaryDirectory() as tmp:
+        for mode, threshold in (("plain", 2 ** 62), ("compressed", default_threshold)):
+            database.COMPRESS_MIN_BYTES = threshold
+            conn = _use_temp_db(tmp, f"storage_{mode}.db")
+            rng = random.Random(rows)
+            with conn:
+                for i in range(rows):
+                    payload = {"prompt": f"task {i}"}
+                    if rng.random() < 0.2:
+                        payload["shell_output"] = _fake_output(rng)
+                    out = _fake_output(rng)
+                    conn.execute(
+                        "INSERT INTO tasks (assigned_to, task_type, payload, status, result) "
+                        "VALUES (?, 'user_request', ?, 'done', ?)",
+                        (rng.choice(DIRECTORS), database._pack(json.dumps(payload)), database._pack(out))
+                    )
+                    conn.execute("INSERT INTO memory (agent, key, value) VALUES ('bench', ?, ?)",
+                                 (f"task_{i}_result", out))
+            conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+            size = database.DB_PATH.stat().st_size / 1024 / 1024
+            ids = [rng.randint(1, rows) for _ in range(50)]
+            full = _timeit(lambda: database.list_tasks(20))
+            summary = _timeit(lambda: database.list_tasks(20, include_result=False))
+            one = _timeit(lambda: database.get_task(rng.choice(ids)))
+            print(f"{mode:<12} {size:>12.1f} {full:>13.3f} {summary:>24.3f} {one:>14.3f}")
+            database.close_connection()
+    database.COMPRESS_MIN_BYTES = default_threshold
+
+
+def _route_loops(prompt: str, routing: dict, approval: list, subtypes: dict) -> tuple:
+    """The pre-router approach: one `in` check per keyword per table."""
+    lower = prompt.lower()
+    scores = {d: sum(kw in lower for kw in kws) for d, kws in routing.items()}
+    top = max(scores, key=scores.get)
+    subtype = next((t for t, kws in subtypes.items() if any(kw in lower for kw in kws)), None)
+    return (top if scores[top] > 0 else "researcher"), any(kw in lower for kw in approval), subtype
+
+
+def bench_route(prompts: int, extra_directors: int):
+    import main
+    from router import Router, best
+
+    rng = random.Random(prompts)
+    phrases = [kw for kws in main.ROUTING.values() for kw in kws] + main.SHELL_APPROVAL_KEYWORDS
+    # Prompts of 6–60 words with 0–3 routing phrases mixed in
+    batch = []
+    for _ in range(prompts):
+        words = rng.choices(_WORDS, k=rng.randint(6, 60))
+        for _ in range(rng.randint(0, 3)):
+            words.insert(rng.randrange(len(words) + 1), rng.choice(phrases))
+        batch.append(" ".join(words))
+
+    def compiled(router):
+        def route(p):
+            s = router.scan(p)
+            return best(s["director"], "researcher"), bool(s["approval"]), best(s["analyst"])
+        return route
+
+    tables = {"real": dict(main.ROUTING)}
+    # Synthetic routes, to show how each approach scales with the keyword count
+    big = dict(main.ROUTING)
+    for i in range(extra_directors):
+        big[f"director{i}"] = [f"{rng.choice(_WORDS)}{i} {rng.choice(_WORDS)}" for _ in range(20)]
+    tables[f"+{extra_directors} routes"] = big
+
+    print(f"{prompts:,} prompts")
+    print(f"{'table':<14} {'keywords':>8} {'loops (ms)':>11} {'router (ms)':>12} {'speedup':>8}")
+    print("-" * 58)
+    for name, routing in tables.items():
+        router = Router(director=routing, approval={"shell": main.SHELL_APPROVAL_KEYWORDS},
+                        analyst=main.ANALYST_SUBTYPES)
+        route = compiled(router)
+        mismatched = sum(route(p) != _route_loops(p, routing, main.SHELL_APPROVAL_KEYWORDS, main.ANALYST_SUBTYPES)
+                         for p in batch)
+        assert not mismatched, f"{mismatched} prompts routed differently"
+        loops = _timeit(lambda: [_route_loops(p, routing, main.SHELL_APPROVAL_KEYWORDS, main.ANALYST_SUBTYPES)
+                                 for p in batch], repeat=5)
+        compiled_ms = _timeit(lambda: [route(p) for p in batch], repeat=5)
+        n_kw = sum(map(len, routing.values()))
+        print(f"{name:<14} {n_kw:>8} {loops:>11.1f} {compiled_ms:>12.1f} {loops / compiled_ms:>7.1f}x")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    sub = parser.add_subparsers(dest="bench", required=True)
+    p_db = sub.add_parser("db", help="task poll / read_memory latency with and without indexes")
+    p_db.add_argument("--rows", type=int, nargs="+", default=[10_000, 100_000, 1_000_000])
+    p_storage = sub.add_parser("storage", help="database size and list latency, plain vs compressed bodies")
+    p_storage.add_argument("--rows", type=int, default=20_000)
+    p_route = sub.add_parser("route", help="bulk routing: per-keyword loops vs the compiled router")
+    p_route.add_argument("--prompts", type=int, default=5_000)
+    p_route.add_argument("--extra-directors", type=int, default=30)
+    args = parser.parse_args()
+
+    if args.bench == "db":
+        bench_db(args.rows)
+    elif args.bench == "storage":
+        bench_storage(args.rows)
+    elif args.bench == "route":
+        bench_route(args.prompts, args.extra_directors)
+    else:
+        sys.exit(f"unknown benchmark {args.bench}")
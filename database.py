@@ -1,84 +1,846 @@
 """Task queue and shared memory for the multi-agent system."""
 
+import os
+import re
 import sqlite3
 import json
+import socket
+import threading
+import time
+import zlib
 from pathlib import Path
-from datetime import datetime
+from datetime import datetime, timedelta, timezone
 
 DB_PATH = Path(__file__).parent / "multiagent.db"
 
+# Default lease for a claimed task — a worker that dies mid-task loses its claim after this
+DEFAULT_LEASE_SECONDS = 300
+
+FINAL_STATUSES = ("done", "failed")
+
+# Woken on every task state change made by this process. Waiters in other
+# processes fall back to watching PRAGMA data_version (see wait_for_task).
+_task_changed = threading.Condition()
+
+
+# Seconds a writer waits on a locked database before raising "database is locked"
+BUSY_TIMEOUT_SECONDS = 30
+
+# One connection per thread, reused across calls (sqlite3 connections can't be
+# shared between threads by default). Keyed on DB_PATH so tests/benchmarks can
+# point the module at another file.
+_local = threading.local()
+_schema_lock = threading.Lock()
+_schema_ready = set()
+
 
 def get_connection():
-    conn = sqlite3.connect(DB_PATH)
-    conn.row_factory = sqlite3.Row
+    """Return this thread's pooled connection, opening it on first use.
+
+    Use as `with get_connection() as conn:` — the block commits or rolls back
+    but leaves the connection open for the next call.
+    """
+    path = str(DB_PATH)
+    conn = getattr(_local, "conn", None)
+    if conn is None or _local.path != path:
+        conn = sqlite3.connect(path, timeout=BUSY_TIMEOUT_SECONDS)
+        conn.row_factory = sqlite3.Row
+        conn.execute(f"PRAGMA busy_timeout = {BUSY_TIMEOUT_SECONDS * 1000}")
+        conn.execute("PRAGMA journal_mode = WAL")
+        conn.execute("PRAGMA synchronous = NORMAL")
+        conn.execute("PRAGMA recursive_triggers = ON")   # dependency failures cascade down a chain
+        _local.conn, _local.path = conn, path
+    if path not in _schema_ready:
+        with _schema_lock:
+            if path not in _schema_ready:
+                _create_schema(conn)
+                _schema_ready.add(path)
     return conn
 
 
+# tasks.payload and tasks.result at least this long (UTF-8 bytes) are stored
+# as zlib BLOBs. TEXT rows written before compression read as-is. memory.value
+# stays plain text, so its FTS triggers need no app-defined SQL function and
+# any SQLite client can still write to memory.
+COMPRESS_MIN_BYTES = 1024
+_COMPRESSED_COLUMNS = ("payload", "result")
+
+
+def _pack(text: str | None):
+    """Value to store for a compressible column: a zlib BLOB when that pays off, else the text."""
+    if text is None:
+        return None
+    data = text.encode()
+    if len(data) < COMPRESS_MIN_BYTES:
+        return text
+    packed = zlib.compress(data)
+    return packed if len(packed) < len(data) else text
+
+
+def _unpack(value):
+    """Inverse of _pack."""
+    return zlib.decompress(value).decode() if isinstance(value, bytes) else value
+
+
+def _row(row) -> dict:
+    """A result row as a dict, with any compressed columns it selected inflated."""
+    d = dict(row)
+    for col in _COMPRESSED_COLUMNS:
+        if isinstance(d.get(col), bytes):
+            d[col] = _unpack(d[col])
+    return d
+
+
+def close_connection():
+    """Close this thread's pooled connection (call before a worker thread exits)."""
+    conn = getattr(_local, "conn", None)
+    if conn is not None:
+        conn.close()
+        _local.conn = None
+
+
 def init_db():
-    with get_connection() as conn:
-        conn.execute("""
-            CREATE TABLE IF NOT EXISTS tasks (
-                id           INTEGER PRIMARY KEY AUTOINCREMENT,
-                created_at   TEXT DEFAULT (datetime('now')),
-                assigned_to  TEXT NOT NULL,
-                task_type    TEXT NOT NULL,
-                payload      TEXT,
-                status       TEXT DEFAULT 'pending',
-                result       TEXT,
-                attempts     INTEGER DEFAULT 0,
-                updated_at   TEXT
-            )
-        """)
-        conn.execute("""
-            CREATE TABLE IF NOT EXISTS memory (
-                id         INTEGER PRIMARY KEY AUTOINCREMENT,
-                agent      TEXT NOT NULL,
-                key        TEXT NOT NULL,
-                value      TEXT,
-                created_at TEXT DEFAULT (datetime('now'))
-            )
-        """)
-        conn.commit()
+    """Ensure the schema exists. Cheap after the first call in a process."""
+    get_connection()
+
+
+# ── Schema migrations ────────────────────────────────────────────────────
+# Each migration runs once, in order, and bumps PRAGMA user_version to its
+# position in MIGRATIONS. Append new ones at the end — never edit or reorder
+# a migration that has shipped.
+
+def _m001_base_tables(conn):
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS tasks (
+            id           INTEGER PRIMARY KEY AUTOINCREMENT,
+            created_at   TEXT DEFAULT (datetime('now')),
+            assigned_to  TEXT NOT NULL,
+            task_type    TEXT NOT NULL,
+            payload      TEXT,
+            status       TEXT DEFAULT 'pending',
+            result       TEXT,
+            attempts     INTEGER DEFAULT 0,
+            updated_at   TEXT
+        )
+    """)
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS memory (
+            id         INTEGER PRIMARY KEY AUTOINCREMENT,
+            agent      TEXT NOT NULL,
+            key        TEXT NOT NULL,
+            value      TEXT,
+            created_at TEXT DEFAULT (datetime('now'))
+        )
+    """)
+
+
+def _m002_task_leases(conn):
+    # Databases created before migrations existed may already have these
+    _add_column(conn, "tasks", "worker_id", "TEXT")
+    _add_column(conn, "tasks", "lease_expires", "TEXT")
+    # Rows left 'running' by pre-lease versions have no worker that will ever
+    # finish them, and nobody is still waiting on their result — fail them
+    # rather than re-running stale work on the first daemon start
+    conn.execute(
+        "UPDATE tasks SET status = 'failed', result = 'abandoned by pre-lease version', updated_at = ? "
+        "WHERE status = 'running' AND lease_expires IS NULL",
+        (datetime.now().isoformat(),)
+    )
+
+
+def _m003_hot_path_indexes(conn):
+    # Director polls / claims: WHERE assigned_to = ? AND status = ? ORDER BY created_at
+    conn.execute(
+        "CREATE INDEX IF NOT EXISTS idx_tasks_queue ON tasks (assigned_to, status, created_at)"
+    )
+    # read_memory: WHERE agent = ? AND key = ? ORDER BY created_at DESC
+    conn.execute(
+        "CREATE INDEX IF NOT EXISTS idx_memory_lookup ON memory (agent, key, created_at)"
+    )
+
+
+def _m004_prompt_cache(conn):
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS prompt_cache (
+            key        TEXT PRIMARY KEY,   -- sha256 of prompt + options
+            result     TEXT NOT NULL,
+            created_at REAL NOT NULL,      -- unix time, for TTL
+            last_used  REAL NOT NULL,      -- unix time, for LRU eviction
+            hits       INTEGER DEFAULT 0
+        )
+    """)
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_prompt_cache_lru ON prompt_cache (last_used)")
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS counters (
+            name  TEXT PRIMARY KEY,
+            value INTEGER NOT NULL DEFAULT 0
+        )
+    """)
+
+
+def _m005_inflight(conn):
+    # Cross-process single-flight locks for identical Claude prompts
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS inflight (
+            key        TEXT PRIMARY KEY,
+            owner      TEXT NOT NULL,
+            state      TEXT NOT NULL DEFAULT 'running',   -- running | done | error
+            result     TEXT,
+            error      TEXT,
+            expires_at REAL NOT NULL                      -- unix time; a dead owner's lock lapses
+        )
+    """)
+
+
+def _m006_sec_scans(conn):
+    # Analyst's per-ticker SEC scan cache
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS sec_scans (
+            ticker     TEXT PRIMARY KEY,
+            output     TEXT NOT NULL,     -- full scanner stdout for the ticker
+            filing_id  TEXT,              -- latest filing accession number the scanner reported
+            scanned_at REAL NOT NULL      -- unix time
+        )
+    """)
+
+
+def _m007_task_counts(conn):
+    # Materialized per-director, per-status task counts for /api/status.
+    # Maintained by triggers; deleting or archiving rows does not decrement,
+    # so the counts are all-time totals.
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS task_counts (
+            assigned_to TEXT NOT NULL,
+            status      TEXT NOT NULL,
+            n           INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (assigned_to, status)
+        )
+    """)
+    conn.execute("""
+        CREATE TRIGGER IF NOT EXISTS trg_task_counts_insert AFTER INSERT ON tasks
+        BEGIN
+            INSERT INTO task_counts (assigned_to, status, n) VALUES (new.assigned_to, new.status, 1)
+            ON CONFLICT(assigned_to, status) DO UPDATE SET n = n + 1;
+        END
+    """)
+    conn.execute("""
+        CREATE TRIGGER IF NOT EXISTS trg_task_counts_update AFTER UPDATE OF status, assigned_to ON tasks
+        WHEN old.status IS NOT new.status OR old.assigned_to IS NOT new.assigned_to
+        BEGIN
+            UPDATE task_counts SET n = n - 1
+             WHERE assigned_to = old.assigned_to AND status = old.status;
+            INSERT INTO task_counts (assigned_to, status, n) VALUES (new.assigned_to, new.status, 1)
+            ON CONFLICT(assigned_to, status) DO UPDATE SET n = n + 1;
+        END
+    """)
+    conn.execute("DELETE FROM task_counts")
+    conn.execute("""
+        INSERT INTO task_counts (assigned_to, status, n)
+        SELECT assigned_to, status, COUNT(*) FROM tasks GROUP BY assigned_to, status
+    """)
+
+
+def _m008_events(conn):
+    # Append-only change feed for the dashboard stream. The id is the resume cursor.
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS events (
+            id          INTEGER PRIMARY KEY AUTOINCREMENT,
+            ts          TEXT DEFAULT (datetime('now')),
+            kind        TEXT NOT NULL,    -- task | alert
+            task_id     INTEGER,
+            assigned_to TEXT,
+            status      TEXT,
+            detail      TEXT
+        )
+    """)
+    conn.execute("""
+        CREATE TRIGGER IF NOT EXISTS trg_events_task_insert AFTER INSERT ON tasks
+        BEGIN
+            INSERT INTO events (kind, task_id, assigned_to, status)
+            VALUES ('task', new.id, new.assigned_to, new.status);
+        END
+    """)
+    conn.execute("""
+        CREATE TRIGGER IF NOT EXISTS trg_events_task_status AFTER UPDATE OF status ON tasks
+        WHEN old.status IS NOT new.status
+        BEGIN
+            INSERT INTO events (kind, task_id, assigned_to, status)
+            VALUES ('task', new.id, new.assigned_to, new.status);
+        END
+    """)
+
+
+def _m009_alerts(conn):
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS alerts (
+            id         INTEGER PRIMARY KEY AUTOINCREMENT,
+            ts         TEXT NOT NULL,
+            task_id    INTEGER,
+            reason     TEXT NOT NULL,
+            attempts   INTEGER,
+            fired_at   REAL NOT NULL,              -- unix time, for cooldown
+            suppressed INTEGER NOT NULL DEFAULT 0  -- repeats swallowed by the cooldown
+        )
+    """)
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_alerts_dedupe ON alerts (task_id, reason, fired_at)")
+    # Per-consumer read position, so drains only see new alerts
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS alert_cursors (
+            consumer TEXT PRIMARY KEY,
+            last_id  INTEGER NOT NULL DEFAULT 0
+        )
+    """)
+
+
+def _m010_worklog_outbox(conn):
+    # Durable queue of WorkLog entries awaiting delivery by worklog.Shipper
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS worklog_outbox (
+            id              INTEGER PRIMARY KEY AUTOINCREMENT,
+            payload         TEXT NOT NULL,                -- JSON body for POST /api/log
+            attempts        INTEGER NOT NULL DEFAULT 0,
+            next_attempt_at REAL NOT NULL DEFAULT 0,      -- unix time; backoff after failures
+            last_error      TEXT,
+            created_at      REAL NOT NULL
+        )
+    """)
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_worklog_outbox_due ON worklog_outbox (next_attempt_at)")
+
+
+def _m011_memory_fts(conn):
+    # Full-text index over memory values (external content — the text lives only in memory)
+    conn.execute("""
+        CREATE VIRTUAL TABLE IF NOT EXISTS memory_fts USING fts5(
+            value, content='memory', content_rowid='id', tokenize='porter unicode61'
+        )
+    """)
+    conn.execute("""
+        CREATE TRIGGER IF NOT EXISTS trg_memory_fts_insert AFTER INSERT ON memory
+        BEGIN
+            INSERT INTO memory_fts (rowid, value) VALUES (new.id, new.value);
+        END
+    """)
+    conn.execute("""
+        CREATE TRIGGER IF NOT EXISTS trg_memory_fts_delete AFTER DELETE ON memory
+        BEGIN
+            INSERT INTO memory_fts (memory_fts, rowid, value) VALUES ('delete', old.id, old.value);
+        END
+    """)
+    conn.execute("""
+        CREATE TRIGGER IF NOT EXISTS trg_memory_fts_update AFTER UPDATE OF value ON memory
+        BEGIN
+            INSERT INTO memory_fts (memory_fts, rowid, value) VALUES ('delete', old.id, old.value);
+            INSERT INTO memory_fts (rowid, value) VALUES (new.id, new.value);
+        END
+    """)
+    conn.execute("INSERT INTO memory_fts (memory_fts) VALUES ('rebuild')")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_memory_recency ON memory (created_at)")
+
+
+def _m012_tasks_archive(conn):
+    # Finished tasks moved out of the hot table by compact(). `data` is the
+    # whole original row as zlib-compressed JSON.
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS tasks_archive (
+            id          INTEGER PRIMARY KEY,
+            assigned_to TEXT NOT NULL,
+            status      TEXT NOT NULL,
+            created_at  TEXT,
+            updated_at  TEXT,
+            archived_at REAL NOT NULL,
+            data        BLOB NOT NULL
+        )
+    """)
+
+
+def _m013_task_priority(conn):
+    _add_column(conn, "tasks", "priority", "INTEGER NOT NULL DEFAULT 0")
+    _add_column(conn, "tasks", "deadline", "TEXT")   # ISO local time, like lease_expires
+
+
+def _m014_task_dags(conn):
+    # A decomposed request is a parent task (status 'waiting', never claimed)
+    # with child subtasks; task_deps orders children that need another's result.
+    _add_column(conn, "tasks", "parent_id", "INTEGER")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_tasks_parent ON tasks (parent_id)")
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS task_deps (
+            task_id    INTEGER NOT NULL,
+            depends_on INTEGER NOT NULL,
+            PRIMARY KEY (task_id, depends_on)
+        )
+    """)
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_task_deps_upstream ON task_deps (depends_on)")
+    # Last child to finish completes the parent. Only its status: children's
+    # results may be compressed, and schema SQL must not call app-defined
+    # functions that other SQLite clients lack — update_task() fills in the
+    # combined result in the same transaction (see _fill_parent_result).
+    conn.execute("""
+        CREATE TRIGGER IF NOT EXISTS trg_tasks_parent_complete AFTER UPDATE OF status ON tasks
+        WHEN new.parent_id IS NOT NULL AND new.status IN ('done', 'failed')
+         AND NOT EXISTS (SELECT 1 FROM tasks WHERE parent_id = new.parent_id
+                                               AND status NOT IN ('done', 'failed'))
+        BEGIN
+            UPDATE tasks
+               SET status = CASE WHEN EXISTS (SELECT 1 FROM tasks WHERE parent_id = new.parent_id
+                                                                    AND status = 'failed')
+                                 THEN 'failed' ELSE 'done' END,
+                   updated_at = strftime('%Y-%m-%dT%H:%M:%f', 'now', 'localtime')
+             WHERE id = new.parent_id AND status = 'waiting';
+        END
+    """)
+    # A task whose dependency failed for good can never run — fail it too
+    conn.execute("""
+        CREATE TRIGGER IF NOT EXISTS trg_tasks_dependency_failed AFTER UPDATE OF status ON tasks
+        WHEN new.status = 'failed' AND old.status IS NOT 'failed'
+        BEGIN
+            UPDATE tasks
+               SET status = 'failed', result = 'Dependency #' || new.id || ' failed',
+                   updated_at = strftime('%Y-%m-%dT%H:%M:%f', 'now', 'localtime')
+             WHERE status IN ('pending', 'waiting')
+               AND id IN (SELECT task_id FROM task_deps WHERE depends_on = new.id);
+        END
+    """)
+
+
+def _m015_retry_not_before(conn):
+    # A task set back to pending after a failure isn't claimable before this (ISO local time)
+    _add_column(conn, "tasks", "not_before", "TEXT")
+
+
+def _m016_task_output(conn):
+    # Subprocess output streamed while a task runs, for tailing and for partial results on timeout
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS task_output (
+            id      INTEGER PRIMARY KEY AUTOINCREMENT,
+            task_id INTEGER NOT NULL,
+            ts      REAL NOT NULL,
+            stream  TEXT NOT NULL,    -- stdout | stderr | note
+            text    TEXT NOT NULL
+        )
+    """)
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_task_output_task ON task_output (task_id, id)")
+
+
+def _m017_worklog_outbox_claims(conn):
+    # Shippers in several processes claim entries before posting them, like claim_tasks
+    _add_column(conn, "worklog_outbox", "origin", "TEXT")          # host:pid that logged the entry
+    _add_column(conn, "worklog_outbox", "claimed_by", "TEXT")
+    _add_column(conn, "worklog_outbox", "claim_expires", "REAL")   # unix time; a dead shipper's claim lapses
+
+
+MIGRATIONS = [
+    _m001_base_tables,
+    _m002_task_leases,
+    _m003_hot_path_indexes,
+    _m004_prompt_cache,
+    _m005_inflight,
+    _m006_sec_scans,
+    _m007_task_counts,
+    _m008_events,
+    _m009_alerts,
+    _m010_worklog_outbox,
+    _m011_memory_fts,
+    _m012_tasks_archive,
+    _m013_task_priority,
+    _m014_task_dags,
+    _m015_retry_not_before,
+    _m016_task_output,
+    _m017_worklog_outbox_claims,
+]
+
+
+def schema_version(conn) -> int:
+    return conn.execute("PRAGMA user_version").fetchone()[0]
+
+
+def _create_schema(conn):
+    """Apply any migrations newer than the database's user_version.
 
+    Each migration runs in its own BEGIN IMMEDIATE transaction, and the
+    version is re-read under the lock so concurrent processes never apply
+    one twice.
+    """
+    while schema_version(conn) < len(MIGRATIONS):
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            version = schema_version(conn)
+            if version < len(MIGRATIONS):
+                MIGRATIONS[version](conn)
+                conn.execute(f"PRAGMA user_version = {version + 1}")
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
 
-def enqueue_task(assigned_to: str, task_type: str, payload: dict) -> int:
-    init_db()
+
+def _add_column(conn, table: str, column: str, decl: str):
+    """Add a column to an existing table if it isn't there yet."""
+    cols = {r["name"] for r in conn.execute(f"PRAGMA table_info({table})")}
+    if column not in cols:
+        conn.execute(f"ALTER TABLE {table} ADD COLUMN {column} {decl}")
+
+
+def default_worker_id() -> str:
+    """Identify the calling worker as host:pid:thread."""
+    return f"{socket.gethostname()}:{os.getpid()}:{threading.get_ident()}"
+
+
+# Named priority levels; any int works, higher is claimed sooner
+PRIORITIES = {"low": -1, "normal": 0, "high": 1, "urgent": 2}
+# A waiting task gains one priority level per this many seconds, up to
+# AGING_MAX_LEVELS, so low-priority work isn't starved. The cap keeps old
+# work from outranking deadlines or much higher priorities: an old "low"
+# task passes fresh "normal" ones, an old "normal" one never reaches "urgent".
+AGING_SECONDS_PER_LEVEL = 1800
+AGING_MAX_LEVELS = 1.5
+# A task whose deadline is this close (or already past) jumps ahead of everything without one
+DEADLINE_URGENT_SECONDS = 300
+_DEADLINE_BOOST = 1000
+
+# Claim order: priority, plus capped aging, plus the deadline boost. Evaluated with
+# named parameters :aging and :urgent_at. created_at is UTC, as julianday('now') is.
+_CLAIM_RANK = """(priority
+        + MIN((julianday('now') - julianday(created_at)) * 86400.0 / :aging, %g)
+        + CASE WHEN deadline IS NOT NULL AND deadline <= :urgent_at THEN %d ELSE 0 END)""" % (
+    AGING_MAX_LEVELS, _DEADLINE_BOOST)
+
+
+# A pending task is blocked while any task it depends on is not yet done
+_UNMET_DEPS = ("SELECT 1 FROM task_deps d JOIN tasks up ON up.id = d.depends_on "
+               "WHERE d.task_id = tasks.id AND up.status != 'done'")
+
+
+def enqueue_task(assigned_to: str, task_type: str, payload: dict,
+                 priority: int = 0, deadline: datetime = None) -> int:
+    """Queue a task. Higher priority is claimed first; a near deadline (local time) moves it to the front."""
     with get_connection() as conn:
         cur = conn.execute(
-            "INSERT INTO tasks (assigned_to, task_type, payload) VALUES (?, ?, ?)",
-            (assigned_to, task_type, json.dumps(payload))
+            "INSERT INTO tasks (assigned_to, task_type, payload, priority, deadline) VALUES (?, ?, ?, ?, ?)",
+            (assigned_to, task_type, _pack(json.dumps(payload)), priority,
+             deadline.isoformat(timespec="seconds") if deadline else None)
         )
         conn.commit()
         return cur.lastrowid
 
 
+def enqueue_tasks(tasks: list) -> list:
+    """Queue many tasks in one transaction; returns their ids in input order.
+
+    Each task is a dict with assigned_to, task_type and payload, and
+    optionally priority and deadline, as for enqueue_task().
+    """
+    if not tasks:
+        return []
+    rows = [(t["assigned_to"], t["task_type"], _pack(json.dumps(t["payload"])), t.get("priority", 0),
+             t["deadline"].isoformat(timespec="seconds") if t.get("deadline") else None) for t in tasks]
+    conn = get_connection()
+    conn.execute("BEGIN IMMEDIATE")   # holding the write lock keeps the new ids contiguous
+    try:
+        conn.executemany(
+            "INSERT INTO tasks (assigned_to, task_type, payload, priority, deadline) VALUES (?, ?, ?, ?, ?)", rows
+        )
+        last = conn.execute("SELECT seq FROM sqlite_sequence WHERE name = 'tasks'").fetchone()[0]
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    _notify_task_change()
+    return list(range(last - len(rows) + 1, last + 1))
+
+
+def enqueue_dag(parent: dict, children: list) -> tuple[int, list]:
+    """Queue a parent task and its subtasks in one transaction.
+
+    parent is {"task_type", "payload", optional "priority"/"deadline"}; it is
+    assigned to "neo", waits until every child is final, and then completes
+    with their aggregated results. Each child is a task dict as for
+    enqueue_tasks() plus optional "after": indexes of earlier children it
+    depends on. A child is claimable once all of those are done.
+
+    Returns (parent_id, child_ids).
+    """
+    def deadline(t):
+        return t["deadline"].isoformat(timespec="seconds") if t.get("deadline") else None
+
+    conn = get_connection()
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        parent_id = conn.execute(
+            "INSERT INTO tasks (assigned_to, task_type, payload, status, priority, deadline) "
+            "VALUES ('neo', ?, ?, 'waiting', ?, ?)",
+            (parent["task_type"], _pack(json.dumps(parent["payload"])), parent.get("priority", 0), deadline(parent))
+        ).lastrowid
+        child_ids = []
+        for child in children:
+            child_id = conn.execute(
+                "INSERT INTO tasks (assigned_to, task_type, payload, priority, deadline, parent_id) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (child["assigned_to"], child["task_type"], _pack(json.dumps(child["payload"])),
+                 child.get("priority", 0), deadline(child), parent_id)
+            ).lastrowid
+            conn.executemany("INSERT INTO task_deps (task_id, depends_on) VALUES (?, ?)",
+                             [(child_id, child_ids[i]) for i in child.get("after", ())])
+            child_ids.append(child_id)
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    _notify_task_change()
+    return parent_id, child_ids
+
+
+def dependency_results(task_id: int) -> list:
+    """Finished tasks this one depends on, oldest first, as {id, assigned_to, prompt, result}."""
+    with get_connection() as conn:
+        rows = conn.execute(
+            "SELECT t.id, t.assigned_to, t.payload, t.result FROM task_deps d JOIN tasks t ON t.id = d.depends_on "
+            "WHERE d.task_id = ? AND t.status = 'done' ORDER BY t.id",
+            (task_id,)
+        ).fetchall()
+    deps = []
+    for r in map(_row, rows):
+        deps.append({"id": r["id"], "assigned_to": r["assigned_to"],
+                     "prompt": json.loads(r["payload"] or "{}").get("prompt", ""), "result": r["result"]})
+    return deps
+
+
 def get_pending_tasks(assigned_to: str) -> list:
-    init_db()
+    """Pending tasks in the order claim_tasks would take them."""
     with get_connection() as conn:
         rows = conn.execute(
-            "SELECT * FROM tasks WHERE assigned_to = ? AND status = 'pending' ORDER BY created_at ASC",
-            (assigned_to,)
+            f"SELECT * FROM tasks WHERE assigned_to = :director AND status = 'pending' "
+            f"ORDER BY {_CLAIM_RANK} DESC, created_at ASC, id ASC",
+            {"director": assigned_to, "aging": AGING_SECONDS_PER_LEVEL,
+             "urgent_at": (datetime.now() + timedelta(seconds=DEADLINE_URGENT_SECONDS)).isoformat(timespec="seconds")}
         ).fetchall()
-        return [dict(r) for r in rows]
+        return [_row(r) for r in rows]
+
 
+def claim_tasks(director: str, n: int = 1, lease_seconds: int = DEFAULT_LEASE_SECONDS,
+                worker_id: str = None, max_attempts: int = None) -> list:
+    """Atomically claim up to n runnable tasks for a director.
 
-def update_task(task_id: int, status: str, result: str = None):
+    Claims pending tasks that are due (not_before has passed) and whose
+    dependencies are all done, plus running tasks whose lease has expired
+    (the worker holding them died), highest rank first — see _CLAIM_RANK.
+    The select and the status flip happen in a single UPDATE ... RETURNING
+    statement, so two processes can never claim the same row.
+
+    Each claim counts as one attempt, so a returned task's `attempts`
+    includes the run about to start. With max_attempts, an expired task
+    that has already had that many is failed instead of reclaimed, so a
+    task that keeps killing its worker or outliving its lease stops
+    coming back.
+    """
+    worker_id = worker_id or default_worker_id()
+    now = datetime.now()
+    now_s = now.isoformat(timespec="seconds")
+    with get_connection() as conn:
+        exhausted = []
+        if max_attempts is not None:
+            exhausted = conn.execute(
+                "UPDATE tasks SET status = 'failed', lease_expires = NULL, updated_at = ?, "
+                "result = 'Lease expired on attempt ' || attempts || ' of ' || ? "
+                "|| ' — the worker died or ran past its lease' "
+                "WHERE assigned_to = ? AND status = 'running' AND lease_expires IS NOT NULL "
+                "AND lease_expires < ? AND attempts >= ? RETURNING id",
+                (now.isoformat(), max_attempts, director, now_s, max_attempts)
+            ).fetchall()
+            for r in exhausted:
+                _fill_parent_result(conn, r["id"])
+        rows = conn.execute(
+            f"""
+            UPDATE tasks
+               SET status = 'running', worker_id = :worker, lease_expires = :lease, updated_at = :now,
+                   attempts = attempts + 1, not_before = NULL
+             WHERE id IN (
+                   SELECT id FROM (
+                          SELECT id, priority, created_at, deadline FROM tasks
+                           WHERE assigned_to = :director AND status = 'pending'
+                             AND (not_before IS NULL OR not_before <= :now_s)
+                             AND NOT EXISTS ({_UNMET_DEPS})
+                          UNION ALL
+                          SELECT id, priority, created_at, deadline FROM tasks
+                           WHERE assigned_to = :director AND status = 'running'
+                             AND lease_expires IS NOT NULL AND lease_expires < :now_s)
+                    ORDER BY {_CLAIM_RANK} DESC, created_at ASC, id ASC
+                    LIMIT :n)
+            RETURNING *, {_CLAIM_RANK} AS claim_rank
+            """,
+            {"worker": worker_id, "lease": (now + timedelta(seconds=lease_seconds)).isoformat(timespec="seconds"),
+             "now": now.isoformat(), "now_s": now_s, "director": director, "n": n,
+             "aging": AGING_SECONDS_PER_LEVEL,
+             "urgent_at": (now + timedelta(seconds=DEADLINE_URGENT_SECONDS)).isoformat(timespec="seconds")}
+        ).fetchall()
+        conn.commit()
+    if rows or exhausted:
+        _notify_task_change()
+    # RETURNING order is unspecified — restore claim order
+    tasks = sorted((_row(r) for r in rows), key=lambda t: (-t["claim_rank"], t["created_at"], t["id"]))
+    for t in tasks:
+        del t["claim_rank"]
+    return tasks
+
+
+def update_task(task_id: int, status: str, result: str = None, not_before: datetime = None,
+                worker_id: str = None, attempts: int = None, unfinished_only: bool = False) -> bool:
+    """Set a task's status and result. not_before delays the next claim of a task put back to pending.
+
+    With worker_id (and the claim's attempts count) the write is fenced: it
+    only applies while the task is still running under that claim. Every
+    claim bumps attempts, so a worker whose lease expired and whose task was
+    reclaimed, even by a thread of the same process, changes nothing.
+    unfinished_only leaves a task that is already done or failed as it is.
+    Returns whether the row was updated.
+    """
+    sql = ("UPDATE tasks SET status = ?, result = ?, updated_at = ?, lease_expires = NULL, not_before = ? "
+           "WHERE id = ?")
+    params = [status, _pack(result), datetime.now().isoformat(),
+              not_before.isoformat(timespec="seconds") if not_before else None, task_id]
+    if worker_id is not None:
+        sql += " AND status = 'running' AND worker_id = ?"
+        params.append(worker_id)
+    if attempts is not None:
+        sql += " AND attempts = ?"
+        params.append(attempts)
+    if unfinished_only:
+        sql += " AND status NOT IN ('done', 'failed')"
+    with get_connection() as conn:
+        updated = conn.execute(sql, params).rowcount
+        if updated and status in FINAL_STATUSES:
+            _fill_parent_result(conn, task_id)
+        conn.commit()
+    if updated:
+        _notify_task_change()
+    return bool(updated)
+
+
+def _fill_parent_result(conn, task_id: int):
+    """After trg_tasks_parent_complete finished task_id's parent, give it every child's result in order."""
+    parent = conn.execute(
+        "SELECT p.id FROM tasks c JOIN tasks p ON p.id = c.parent_id "
+        "WHERE c.id = ? AND p.status IN ('done', 'failed') AND p.result IS NULL",
+        (task_id,)
+    ).fetchone()
+    if parent is None:
+        return
+    parts = []
+    for c in map(_row, conn.execute(
+            "SELECT assigned_to, payload, status, result FROM tasks WHERE parent_id = ? ORDER BY id",
+            (parent["id"],))):
+        prompt = json.loads(c["payload"] or "{}").get("prompt", "")
+        parts.append(f"### [{c['assigned_to']}] {prompt} ({c['status']})\n{c['result'] or ''}")
+    conn.execute("UPDATE tasks SET result = ? WHERE id = ?", (_pack("\n\n".join(parts)), parent["id"]))
+
+
+def set_task_progress(task_id: int, result: str):
+    """Overwrite a running task's partial result without changing its status."""
     with get_connection() as conn:
         conn.execute(
-            "UPDATE tasks SET status = ?, result = ?, updated_at = ?, attempts = attempts + 1 WHERE id = ?",
-            (status, result, datetime.now().isoformat(), task_id)
+            "UPDATE tasks SET result = ?, updated_at = ? WHERE id = ?",
+            (_pack(result), datetime.now().isoformat(), task_id)
         )
         conn.commit()
+    _notify_task_change()
+
+
+def renew_lease(task_id: int, worker_id: str, lease_seconds: int) -> bool:
+    """Extend a running task's lease for a long run. False if worker_id no longer holds it."""
+    with get_connection() as conn:
+        updated = conn.execute(
+            "UPDATE tasks SET lease_expires = ? WHERE id = ? AND status = 'running' AND worker_id = ?",
+            ((datetime.now() + timedelta(seconds=lease_seconds)).isoformat(timespec="seconds"),
+             task_id, worker_id)
+        ).rowcount
+        conn.commit()
+    return bool(updated)
+
+
+def _notify_task_change():
+    with _task_changed:
+        _task_changed.notify_all()
+
+
+def wait_for_task(task_id: int, timeout: float, statuses=FINAL_STATUSES,
+                  poll_interval: float = 0.1) -> dict | None:
+    """Block until a task reaches one of `statuses` or `timeout` seconds pass.
+
+    Returns the latest task row either way (None if the task doesn't exist),
+    so callers check the status to tell completion from timeout. Tasks that
+    compact() has archived come back from tasks_archive, as with get_task.
+
+    Changes made in this process (daemon, inline directors) wake the waiter
+    immediately. Changes from other processes are picked up within
+    poll_interval by checking PRAGMA data_version, which costs no table
+    read — the row is only re-fetched when the database actually changed.
+    """
+    def check(conn):
+        row = conn.execute("SELECT * FROM tasks WHERE id = ?", (task_id,)).fetchone()
+        if row is None:
+            return True, _archived_task(conn, task_id)   # compact() moved it, or it doesn't exist
+        task = _row(row)
+        return task["status"] in statuses, task
+
+    return _watch(check, timeout, poll_interval)
+
+
+def _watch(check, timeout: float, poll_interval: float):
+    """Run check(conn) now and again after each database change until it reports done.
+
+    check returns (done, value). The last value is returned when done or
+    when timeout expires. See wait_for_task for the wake-up mechanism.
+    """
+    deadline = time.monotonic() + timeout
+    conn = get_connection()
+    version = None
+    value = None
+    while True:
+        current = conn.execute("PRAGMA data_version").fetchone()[0]
+        if current != version:
+            version = current
+            done, value = check(conn)
+            if done:
+                return value
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            return value
+        with _task_changed:
+            _task_changed.wait(min(poll_interval, remaining))
+
+
+def wait_for_change(version: int | None, timeout: float, poll_interval: float = 0.25) -> int:
+    """Block until another connection commits after `version`, or timeout seconds pass.
+
+    version is a value returned by an earlier call on the same thread (a
+    PRAGMA data_version). Pass None to get the current one at once. Returns
+    the current version: unchanged means the timeout passed. Wakes up like
+    wait_for_task.
+    """
+    deadline = time.monotonic() + timeout
+    conn = get_connection()
+    while True:
+        current = conn.execute("PRAGMA data_version").fetchone()[0]
+        remaining = deadline - time.monotonic()
+        if current != version or remaining <= 0:
+            return current
+        with _task_changed:
+            _task_changed.wait(min(poll_interval, remaining))
 
 
 def get_task(task_id: int) -> dict:
+    """A task by id, falling back to the archive for tasks compact() has moved."""
     with get_connection() as conn:
         row = conn.execute("SELECT * FROM tasks WHERE id = ?", (task_id,)).fetchone()
-        return dict(row) if row else None
+        return _row(row) if row else _archived_task(conn, task_id)
+
+
+def _archived_task(conn, task_id: int) -> dict | None:
+    row = conn.execute("SELECT data FROM tasks_archive WHERE id = ?", (task_id,)).fetchone()
+    return json.loads(zlib.decompress(row["data"])) if row else None
 
 
 def write_memory(agent: str, key: str, value: str):
-    init_db()
     with get_connection() as conn:
         conn.execute(
             "INSERT INTO memory (agent, key, value) VALUES (?, ?, ?)",
@@ -88,7 +850,6 @@ def write_memory(agent: str, key: str, value: str):
 
 
 def read_memory(agent: str, key: str) -> str | None:
-    init_db()
     with get_connection() as conn:
         row = conn.execute(
             "SELECT value FROM memory WHERE agent = ? AND key = ? ORDER BY created_at DESC LIMIT 1",
@@ -97,18 +858,77 @@ def read_memory(agent: str, key: str) -> str | None:
         return row["value"] if row else None
 
 
-def list_tasks(limit: int = 20) -> list:
-    init_db()
+# Words too common to help rank memory matches
+_SEARCH_STOPWORDS = {
+    "the", "and", "for", "with", "that", "this", "what", "who", "how", "are", "was", "you",
+    "your", "from", "into", "about", "task", "provide", "clear", "summary", "please",
+}
+_SEARCH_MAX_TERMS = 32
+
+
+def _fts_query(text: str) -> str:
+    """Turn free text into an FTS5 OR-query of quoted terms (no FTS syntax leaks through)."""
+    terms = []
+    for word in re.findall(r"\w+", text.lower()):
+        if len(word) > 2 and word not in _SEARCH_STOPWORDS and word not in terms:
+            terms.append(word)
+    return " OR ".join(f'"{t}"' for t in terms[:_SEARCH_MAX_TERMS])
+
+
+def search_memory(query: str, agents: list = None, limit: int = 5, since: str = None) -> list:
+    """Rank memory rows against free text by BM25, newest first among equal scores.
+
+    agents restricts to those agents' rows; since ("YYYY-MM-DD[ HH:MM:SS]",
+    UTC like created_at) drops older rows. Each hit carries its bm25 `score`
+    (lower is better).
+    """
+    match = _fts_query(query)
+    if not match:
+        return []
+    sql = ("SELECT m.id, m.agent, m.key, m.value, m.created_at, bm25(memory_fts) AS score "
+           "FROM memory_fts JOIN memory m ON m.id = memory_fts.rowid "
+           "WHERE memory_fts MATCH ?")
+    params = [match]
+    if agents:
+        sql += f" AND m.agent IN ({', '.join('?' * len(agents))})"
+        params += list(agents)
+    if since:
+        sql += " AND m.created_at >= ?"
+        params.append(since)
+    sql += " ORDER BY score, m.created_at DESC LIMIT ?"
+    params.append(limit)
+    with get_connection() as conn:
+        return [dict(r) for r in conn.execute(sql, params).fetchall()]
+
+
+# Every tasks column except the potentially large result body
+TASK_SUMMARY_COLUMNS = ("id, created_at, assigned_to, task_type, payload, status, attempts, "
+                        "updated_at, worker_id, lease_expires, priority, deadline, parent_id, not_before")
+
+
+def list_tasks(limit: int = 20, before_id: int = None, include_result: bool = True) -> list:
+    """Newest tasks first. Pass the last id of a page as before_id to get the next page."""
+    columns = "*" if include_result else TASK_SUMMARY_COLUMNS
     with get_connection() as conn:
         rows = conn.execute(
-            "SELECT * FROM tasks ORDER BY created_at DESC LIMIT ?", (limit,)
+            f"SELECT {columns} FROM tasks WHERE id < ? ORDER BY id DESC LIMIT ?",
+            (before_id if before_id is not None else 2 ** 63 - 1, limit)
         ).fetchall()
-        return [dict(r) for r in rows]
+        return [_row(r) for r in rows]
+
+
+def task_counts() -> dict:
+    """All-time task counts as {director: {status: n}} — a read of the materialized table."""
+    counts = {}
+    with get_connection() as conn:
+        for r in conn.execute("SELECT assigned_to, status, n FROM task_counts WHERE n > 0"):
+            counts.setdefault(r["assigned_to"], {})[r["status"]] = r["n"]
+    return counts
 
 
-def mark_failed(task_id: int, reason: str = "Unknown"):
-    """Mark a task as failed with a reason."""
-    update_task(task_id, "failed", reason)
+def mark_failed(task_id: int, reason: str = "Unknown") -> bool:
+    """Mark a task as failed with a reason, unless it already finished. Returns whether it was marked."""
+    return update_task(task_id, "failed", reason, unfinished_only=True)
 
 
 def get_task_attempts(task_id: int) -> int:
@@ -118,3 +938,472 @@ def get_task_attempts(task_id: int) -> int:
             "SELECT attempts FROM tasks WHERE id = ?", (task_id,)
         ).fetchone()
         return row["attempts"] if row else 0
+
+
+def bump_counter(name: str, n: int = 1, conn=None):
+    """Increment a named counter (shared across processes)."""
+    sql = ("INSERT INTO counters (name, value) VALUES (?, ?) "
+           "ON CONFLICT(name) DO UPDATE SET value = value + excluded.value")
+    if conn is not None:
+        conn.execute(sql, (name, n))
+        return
+    with get_connection() as conn:
+        conn.execute(sql, (name, n))
+
+
+def get_counters(prefix: str = "") -> dict:
+    with get_connection() as conn:
+        rows = conn.execute(
+            "SELECT name, value FROM counters WHERE substr(name, 1, ?) = ?", (len(prefix), prefix)
+        ).fetchall()
+        return {r["name"]: r["value"] for r in rows}
+
+
+def cache_get(key: str, ttl_seconds: float) -> str | None:
+    """Return a cached prompt result if present and younger than ttl_seconds."""
+    now = time.time()
+    with get_connection() as conn:
+        row = conn.execute(
+            "SELECT result, created_at FROM prompt_cache WHERE key = ?", (key,)
+        ).fetchone()
+        if row and now - row["created_at"] < ttl_seconds:
+            conn.execute(
+                "UPDATE prompt_cache SET last_used = ?, hits = hits + 1 WHERE key = ?", (now, key)
+            )
+            bump_counter("prompt_cache.hits", conn=conn)
+            return row["result"]
+        if row:
+            conn.execute("DELETE FROM prompt_cache WHERE key = ?", (key,))
+            bump_counter("prompt_cache.expired", conn=conn)
+        bump_counter("prompt_cache.misses", conn=conn)
+        return None
+
+
+def cache_put(key: str, result: str, max_entries: int):
+    """Store a prompt result, evicting least-recently-used entries beyond max_entries."""
+    now = time.time()
+    with get_connection() as conn:
+        conn.execute(
+            "INSERT OR REPLACE INTO prompt_cache (key, result, created_at, last_used) VALUES (?, ?, ?, ?)",
+            (key, result, now, now)
+        )
+        evicted = conn.execute(
+            "DELETE FROM prompt_cache WHERE key IN ("
+            "  SELECT key FROM prompt_cache ORDER BY last_used DESC LIMIT -1 OFFSET ?)",
+            (max_entries,)
+        ).rowcount
+        if evicted:
+            bump_counter("prompt_cache.evictions", evicted, conn=conn)
+
+
+def prompt_cache_stats() -> dict:
+    """Hit/miss/eviction counters plus current size, for the status API."""
+    stats = {k.split(".", 1)[1]: v for k, v in get_counters("prompt_cache.").items()}
+    with get_connection() as conn:
+        stats["entries"] = conn.execute("SELECT COUNT(*) FROM prompt_cache").fetchone()[0]
+    return {name: stats.get(name, 0) for name in ("hits", "misses", "expired", "evictions", "entries")}
+
+
+# Finished single-flight rows stay readable this long so waiting processes can collect them
+INFLIGHT_RESULT_GRACE_SECONDS = 60
+
+
+def try_acquire_inflight(key: str, owner: str, lease_seconds: float) -> bool:
+    """Take the single-flight lock for key unless another live owner is running it."""
+    now = time.time()
+    with get_connection() as conn:
+        conn.execute(
+            "DELETE FROM inflight WHERE state != 'running' AND expires_at < ?", (now,)
+        )
+        conn.execute(
+            """
+            INSERT INTO inflight (key, owner, state, expires_at) VALUES (?, ?, 'running', ?)
+            ON CONFLICT(key) DO UPDATE
+               SET owner = excluded.owner, state = 'running', result = NULL, error = NULL,
+                   expires_at = excluded.expires_at
+             WHERE inflight.state != 'running' OR inflight.expires_at < ?
+            """,
+            (key, owner, now + lease_seconds, now)
+        )
+        row = conn.execute("SELECT owner FROM inflight WHERE key = ?", (key,)).fetchone()
+        return row is not None and row["owner"] == owner
+
+
+def finish_inflight(key: str, owner: str, result: str = None, error: str = None):
+    """Publish the outcome of a single-flight run for waiters in other processes."""
+    with get_connection() as conn:
+        conn.execute(
+            "UPDATE inflight SET state = ?, result = ?, error = ?, expires_at = ? "
+            "WHERE key = ? AND owner = ?",
+            ("error" if error is not None else "done", result, error,
+             time.time() + INFLIGHT_RESULT_GRACE_SECONDS, key, owner)
+        )
+
+
+def get_inflight(key: str) -> dict | None:
+    with get_connection() as conn:
+        row = conn.execute("SELECT * FROM inflight WHERE key = ?", (key,)).fetchone()
+        return dict(row) if row else None
+
+
+def get_sec_scan(ticker: str) -> dict | None:
+    with get_connection() as conn:
+        row = conn.execute("SELECT * FROM sec_scans WHERE ticker = ?", (ticker,)).fetchone()
+        return dict(row) if row else None
+
+
+def put_sec_scan(ticker: str, output: str, filing_id: str = None):
+    with get_connection() as conn:
+        conn.execute(
+            "INSERT OR REPLACE INTO sec_scans (ticker, output, filing_id, scanned_at) VALUES (?, ?, ?, ?)",
+            (ticker, output, filing_id, time.time())
+        )
+
+
+def add_event(kind: str, task_id: int = None, status: str = None, detail: str = None):
+    """Append a non-task event (task transitions are recorded by triggers)."""
+    with get_connection() as conn:
+        conn.execute(
+            "INSERT INTO events (kind, task_id, status, detail) VALUES (?, ?, ?, ?)",
+            (kind, task_id, status, detail)
+        )
+    _notify_task_change()
+
+
+def latest_event_id() -> int:
+    with get_connection() as conn:
+        return conn.execute("SELECT COALESCE(MAX(id), 0) FROM events").fetchone()[0]
+
+
+def wait_for_events(after_id: int, timeout: float, limit: int = 100,
+                    poll_interval: float = 0.25) -> list:
+    """Return events with id > after_id, blocking up to timeout for the first one."""
+    def check(conn):
+        rows = conn.execute(
+            "SELECT * FROM events WHERE id > ? ORDER BY id LIMIT ?", (after_id, limit)
+        ).fetchall()
+        return bool(rows), [dict(r) for r in rows]
+
+    return _watch(check, timeout, poll_interval) or []
+
+
+def record_alert(task_id: int, reason: str, attempts: int, ts: str, cooldown_seconds: float) -> int | None:
+    """Insert an alert unless the same (task_id, reason) fired within the cooldown.
+
+    Returns the new alert id, or None if it was suppressed as a repeat.
+    """
+    now = time.time()
+    conn = get_connection()
+    conn.execute("BEGIN IMMEDIATE")   # check-then-insert must not race another process
+    try:
+        recent = conn.execute(
+            "SELECT id FROM alerts WHERE task_id IS ? AND reason = ? AND fired_at > ? "
+            "ORDER BY fired_at DESC LIMIT 1",
+            (task_id, reason, now - cooldown_seconds)
+        ).fetchone()
+        if recent:
+            conn.execute("UPDATE alerts SET suppressed = suppressed + 1 WHERE id = ?", (recent["id"],))
+            alert_id = None
+        else:
+            alert_id = conn.execute(
+                "INSERT INTO alerts (ts, task_id, reason, attempts, fired_at) VALUES (?, ?, ?, ?, ?)",
+                (ts, task_id, reason, attempts, now)
+            ).lastrowid
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    return alert_id
+
+
+def recent_alerts(limit: int = 20) -> list:
+    """Latest alerts, oldest first."""
+    with get_connection() as conn:
+        rows = conn.execute("SELECT * FROM alerts ORDER BY id DESC LIMIT ?", (limit,)).fetchall()
+        return [dict(r) for r in reversed(rows)]
+
+
+def alerts_after_cursor(consumer: str, limit: int = 100) -> list:
+    """Alerts this consumer hasn't acknowledged yet, oldest first."""
+    with get_connection() as conn:
+        row = conn.execute("SELECT last_id FROM alert_cursors WHERE consumer = ?", (consumer,)).fetchone()
+        rows = conn.execute(
+            "SELECT * FROM alerts WHERE id > ? ORDER BY id LIMIT ?", (row["last_id"] if row else 0, limit)
+        ).fetchall()
+        return [dict(r) for r in rows]
+
+
+def ack_alerts(consumer: str, last_id: int):
+    """Advance a consumer's cursor past last_id (never backwards)."""
+    with get_connection() as conn:
+        conn.execute(
+            "INSERT INTO alert_cursors (consumer, last_id) VALUES (?, ?) "
+            "ON CONFLICT(consumer) DO UPDATE SET last_id = MAX(last_id, excluded.last_id)",
+            (consumer, last_id)
+        )
+
+
+def outbox_add(payload: dict, origin: str = None) -> int:
+    with get_connection() as conn:
+        return conn.execute(
+            "INSERT INTO worklog_outbox (payload, created_at, origin) VALUES (?, ?, ?)",
+            (json.dumps(payload), time.time(), origin)
+        ).lastrowid
+
+
+def outbox_claim(owner: str, limit: int, claim_seconds: float, origin: str = None) -> list:
+    """Atomically claim up to limit due entries for owner, oldest first.
+
+    As in claim_tasks, the select and the claim are a single
+    UPDATE ... RETURNING, so two shippers never post the same entry. Other
+    shippers skip a claimed entry until claim_seconds pass (its owner died
+    mid-post). origin limits the claim to entries logged by that process.
+    """
+    now = time.time()
+    with get_connection() as conn:
+        rows = conn.execute(
+            """
+            UPDATE worklog_outbox SET claimed_by = :owner, claim_expires = :expires
+             WHERE id IN (
+                   SELECT id FROM worklog_outbox
+                    WHERE next_attempt_at <= :now
+                      AND (claim_expires IS NULL OR claim_expires < :now)
+                      AND (:origin IS NULL OR origin = :origin)
+                    ORDER BY id
+                    LIMIT :limit)
+            RETURNING *
+            """,
+            {"owner": owner, "expires": now + claim_seconds, "now": now, "origin": origin, "limit": limit}
+        ).fetchall()
+    # RETURNING order is unspecified
+    return sorted((dict(r) for r in rows), key=lambda r: r["id"])
+
+
+def outbox_delete(ids: list, owner: str):
+    """Drop delivered entries still claimed by owner."""
+    with get_connection() as conn:
+        conn.executemany("DELETE FROM worklog_outbox WHERE id = ? AND claimed_by = ?",
+                         [(i, owner) for i in ids])
+
+
+def outbox_defer(entry_id: int, next_attempt_at: float, error: str, owner: str):
+    """Release a failed entry with a backoff before its next attempt."""
+    with get_connection() as conn:
+        conn.execute(
+            "UPDATE worklog_outbox SET attempts = attempts + 1, next_attempt_at = ?, last_error = ?, "
+            "claimed_by = NULL, claim_expires = NULL WHERE id = ? AND claimed_by = ?",
+            (next_attempt_at, error[:500], entry_id, owner)
+        )
+
+
+def outbox_release(ids: list, owner: str):
+    """Hand back claimed entries that were not attempted."""
+    with get_connection() as conn:
+        conn.executemany(
+            "UPDATE worklog_outbox SET claimed_by = NULL, claim_expires = NULL WHERE id = ? AND claimed_by = ?",
+            [(i, owner) for i in ids]
+        )
+
+
+def append_task_output(task_id: int, chunks: list):
+    """Append (stream, text) chunks to a task's captured output in one transaction."""
+    now = time.time()
+    with get_connection() as conn:
+        conn.executemany(
+            "INSERT INTO task_output (task_id, ts, stream, text) VALUES (?, ?, ?, ?)",
+            [(task_id, now, stream, text) for stream, text in chunks]
+        )
+    _notify_task_change()
+
+
+def task_output(task_id: int, after_id: int = 0, limit: int = 500) -> list:
+    """Output chunks of a task with id > after_id, oldest first."""
+    with get_connection() as conn:
+        rows = conn.execute(
+            "SELECT id, ts, stream, text FROM task_output WHERE task_id = ? AND id > ? ORDER BY id LIMIT ?",
+            (task_id, after_id, limit)
+        ).fetchall()
+        return [dict(r) for r in rows]
+
+
+def task_output_tail(task_id: int, limit: int = 50) -> list:
+    """The last `limit` output chunks of a task, oldest first."""
+    with get_connection() as conn:
+        rows = conn.execute(
+            "SELECT id, ts, stream, text FROM task_output WHERE task_id = ? ORDER BY id DESC LIMIT ?",
+            (task_id, limit)
+        ).fetchall()
+        return [dict(r) for r in reversed(rows)]
+
+
+def wait_for_task_output(task_id: int, after_id: int, timeout: float, limit: int = 500,
+                         poll_interval: float = 0.25) -> list:
+    """Like task_output(), but block up to timeout for the first new chunk."""
+    def check(conn):
+        rows = conn.execute(
+            "SELECT id, ts, stream, text FROM task_output WHERE task_id = ? AND id > ? ORDER BY id LIMIT ?",
+            (task_id, after_id, limit)
+        ).fetchall()
+        return bool(rows), [dict(r) for r in rows]
+
+    return _watch(check, timeout, poll_interval) or []
+
+
+# ── Retention ────────────────────────────────────────────────────────────
+# compact() works in small batches, each its own short write transaction,
+# so directors and the API are never locked out for long.
+
+MEMORY_HISTORY_DEPTH = 1         # values kept per (agent, key), newest first
+MEMORY_MAX_AGE_DAYS = None       # also drop memory older than this (None keeps it)
+TASK_ARCHIVE_AFTER_DAYS = 7      # done/failed tasks untouched this long move to tasks_archive
+EVENT_RETENTION_DAYS = 7         # change-feed rows older than this are dropped
+COMPACT_BATCH = 500              # rows per write transaction
+COMPACT_PAUSE_SECONDS = 0.01     # pause between batches to let other writers in
+VACUUM_STEP_PAGES = 1000         # free pages returned to the OS per incremental_vacuum
+
+
+def _write_step(step) -> int:
+    """Run step(conn) -> rows affected in one short write transaction."""
+    conn = get_connection()
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        n = step(conn)
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    return n
+
+
+def _in_batches(step) -> int:
+    """Run step(conn) -> rows affected until it returns less than COMPACT_BATCH."""
+    total = 0
+    while True:
+        n = _write_step(step)
+        total += n
+        if n < COMPACT_BATCH:
+            return total
+        time.sleep(COMPACT_PAUSE_SECONDS)
+
+
+def _delete_ids(table: str, ids: list) -> int:
+    """Delete rows of table by id, COMPACT_BATCH per write transaction."""
+    total = 0
+    for i in range(0, len(ids), COMPACT_BATCH):
+        chunk = ids[i:i + COMPACT_BATCH]
+        total += _write_step(lambda conn: conn.execute(
+            f"DELETE FROM {table} WHERE id IN ({','.join('?' * len(chunk))})", chunk
+        ).rowcount)
+        time.sleep(COMPACT_PAUSE_SECONDS)
+    return total
+
+
+def prune_memory(depth: int = MEMORY_HISTORY_DEPTH, max_age_days: float = MEMORY_MAX_AGE_DAYS) -> int:
+    """Delete memory beyond the newest `depth` values per (agent, key), and rows past max_age_days."""
+    cutoff = ""
+    if max_age_days is not None:
+        cutoff = (datetime.now(timezone.utc) - timedelta(days=max_age_days)).strftime("%Y-%m-%d %H:%M:%S")
+
+    # Ranking every (agent, key) history is the slow part, so it runs as a
+    # plain read, which in WAL mode blocks no writer. Only the deletes by id
+    # take the write lock, a batch at a time. A row found surplus here stays
+    # surplus if newer values land meanwhile.
+    with get_connection() as conn:
+        ids = [r["id"] for r in conn.execute(
+            """
+            SELECT id FROM (
+                SELECT id, created_at, ROW_NUMBER() OVER (
+                           PARTITION BY agent, key ORDER BY created_at DESC, id DESC) AS rn
+                  FROM memory)
+             WHERE rn > ? OR created_at < ?
+             ORDER BY id
+            """,
+            (depth, cutoff)
+        )]
+    return _delete_ids("memory", ids)
+
+
+def archive_tasks(older_than_days: float = TASK_ARCHIVE_AFTER_DAYS) -> int:
+    """Move done/failed tasks last updated before the cutoff into tasks_archive.
+
+    task_counts stays all-time (it has no delete trigger), and get_task()
+    still finds archived tasks.
+    """
+    cutoff = (datetime.now() - timedelta(days=older_than_days)).isoformat()
+
+    def step(conn):
+        rows = conn.execute(
+            "SELECT * FROM tasks WHERE status IN ('done', 'failed') "
+            "AND COALESCE(updated_at, created_at) < ? ORDER BY id LIMIT ?",
+            (cutoff, COMPACT_BATCH)
+        ).fetchall()
+        now = time.time()
+        conn.executemany(
+            "INSERT OR REPLACE INTO tasks_archive "
+            "(id, assigned_to, status, created_at, updated_at, archived_at, data) VALUES (?, ?, ?, ?, ?, ?, ?)",
+            [(r["id"], r["assigned_to"], r["status"], r["created_at"], r["updated_at"], now,
+              zlib.compress(json.dumps(_row(r)).encode())) for r in rows]
+        )
+        conn.executemany("DELETE FROM tasks WHERE id = ?", [(r["id"],) for r in rows])
+        conn.executemany("DELETE FROM task_deps WHERE task_id = ?", [(r["id"],) for r in rows])
+        conn.executemany("DELETE FROM task_output WHERE task_id = ?", [(r["id"],) for r in rows])
+        return len(rows)
+
+    return _in_batches(step)
+
+
+def prune_events(older_than_days: float = EVENT_RETENTION_DAYS) -> int:
+    """Drop change-feed events older than the cutoff."""
+    cutoff = (datetime.now(timezone.utc) - timedelta(days=older_than_days)).strftime("%Y-%m-%d %H:%M:%S")
+
+    def step(conn):
+        return conn.execute(
+            "DELETE FROM events WHERE id IN (SELECT id FROM events WHERE ts < ? ORDER BY id LIMIT ?)",
+            (cutoff, COMPACT_BATCH)
+        ).rowcount
+
+    return _in_batches(step)
+
+
+def db_space() -> dict:
+    """File sizes and free (reusable) space of the database, in bytes."""
+    with get_connection() as conn:
+        page_size = conn.execute("PRAGMA page_size").fetchone()[0]
+        free = conn.execute("PRAGMA freelist_count").fetchone()[0] * page_size
+    wal = Path(str(DB_PATH) + "-wal")
+    return {
+        "file_bytes": DB_PATH.stat().st_size if DB_PATH.exists() else 0,
+        "wal_bytes": wal.stat().st_size if wal.exists() else 0,
+        "free_bytes": free,
+    }
+
+
+def compact(vacuum: bool = False) -> dict:
+    """Apply every retention rule, then hand free pages back to the OS.
+
+    Free pages are released with incremental_vacuum, a few at a time, once
+    the database is in auto_vacuum=INCREMENTAL mode. Switching to that mode
+    needs one full VACUUM — pass vacuum=True (it holds the write lock for
+    the whole rewrite, so run it when the system is quiet).
+    """
+    before = db_space()
+    stats = {
+        "memory_pruned": prune_memory(),
+        "tasks_archived": archive_tasks(),
+        "events_pruned": prune_events(),
+    }
+    conn = get_connection()
+    stats["incremental_vacuum"] = conn.execute("PRAGMA auto_vacuum").fetchone()[0] == 2
+    if stats["incremental_vacuum"]:
+        while conn.execute("PRAGMA freelist_count").fetchone()[0] > 0:
+            conn.execute(f"PRAGMA incremental_vacuum({VACUUM_STEP_PAGES})").fetchall()
+            time.sleep(COMPACT_PAUSE_SECONDS)
+    elif vacuum:
+        conn.execute("PRAGMA auto_vacuum = INCREMENTAL")
+        conn.execute("VACUUM")
+    conn.execute("PRAGMA wal_checkpoint(TRUNCATE)").fetchall()
+    after = db_space()
+    stats.update(before=before, after=after,
+                 reclaimed_bytes=(before["file_bytes"] + before["wal_bytes"])
+                 - (after["file_bytes"] + after["wal_bytes"]))
+    return stats
@@ -1,17 +1,26 @@
 """Neo CEO Agent — entry point for the multi-agent system."""
 
+import os
+import re
 import sys
+import asyncio
 import json
 import time
 import signal
+import threading
 import subprocess
-from datetime import datetime
-from database import enqueue_task, get_task, list_tasks, read_memory, init_db, mark_failed, get_task_attempts
+from datetime import datetime, timedelta
+from pathlib import Path
+from database import (enqueue_task, enqueue_tasks, enqueue_dag, get_task, latest_event_id, wait_for_events,
+                      list_tasks, read_memory, init_db, mark_failed, get_task_attempts, wait_for_task,
+                      close_connection, compact, task_output_tail, wait_for_task_output,
+                      FINAL_STATUSES, PRIORITIES)
 from alerts import fire_alert
 from agents.builder import BuilderDirector
 from agents.researcher import ResearcherDirector
-from agents.analyst import AnalystDirector
-from audit import log as audit_log
+from agents.analyst import AnalystDirector, ANALYST_SUBTYPES, SEC_SCAN_KEYWORDS
+from audit import log as audit_log, tail as audit_tail
+from router import Router, best
 
 DIRECTORS = {
     "builder": BuilderDirector(),
@@ -24,32 +33,53 @@ ROUTING = {
     "builder":    ["build", "code", "create", "write", "fix", "implement", "develop"],
     "researcher": ["research", "find", "search", "look up", "what is", "who is", "explain", "summarize"],
     "analyst":    ["analyze", "analyse", "scan", "report", "compare", "review data", "stats", "metrics",
-                   "sec scan", "sec scanner", "ai washing", "watchlist scan", "scan ticker"],
+                   *SEC_SCAN_KEYWORDS],
 }
+# Where a prompt goes when no routing keyword matches
+DEFAULT_DIRECTOR = "researcher"
 
 # Tasks containing these keywords require human approval before shell execution
 SHELL_APPROVAL_KEYWORDS = ["shell", "run command", "execute", "bash", "terminal"]
 
-# Max seconds a task is allowed to run before being killed
-TASK_TIMEOUT_SECONDS = 180
+# Every keyword table above, compiled once — see router.py
+ROUTER = Router(director=ROUTING, approval={"shell": SHELL_APPROVAL_KEYWORDS}, analyst=ANALYST_SUBTYPES)
+
+# Written by --serve so CLI invocations know a daemon is draining the queue
+PIDFILE = Path(__file__).parent / "multiagent.pid"
+
+# While waiting on a task, wake at least this often to check for approval stalls
+STALL_CHECK_SECONDS = 10
+
+# `--tail -f` checks the task's status at least this often while no output arrives
+TAIL_POLL_SECONDS = 2.0
+
+# Seconds an idle daemon director waits before checking the queue again
+SERVE_POLL_SECONDS = 1.0
+
+
+def classify(task_str: str) -> dict:
+    """Route a task in one pass over the prompt.
+
+    Returns {"director", "scores" (per director), "approval" (needs human
+    sign-off), "analyst_type" (sub-type, or None)}.
+    """
+    scores = ROUTER.scan(task_str)
+    return {
+        "director": best(scores["director"], DEFAULT_DIRECTOR),
+        "scores": scores["director"],
+        "approval": bool(scores["approval"]),
+        "analyst_type": best(scores["analyst"]),
+    }
 
 
 def route_task(task_str: str) -> str:
     """Decide which Director should handle this task."""
-    lower = task_str.lower()
-    scores = {director: 0 for director in ROUTING}
-    for director, keywords in ROUTING.items():
-        for kw in keywords:
-            if kw in lower:
-                scores[director] += 1
-    best = max(scores, key=scores.get)
-    return best if scores[best] > 0 else "researcher"
+    return classify(task_str)["director"]
 
 
 def needs_approval(task_str: str) -> bool:
     """Return True if this task touches shell execution and needs human sign-off."""
-    lower = task_str.lower()
-    return any(kw in lower for kw in SHELL_APPROVAL_KEYWORDS)
+    return classify(task_str)["approval"]
 
 
 def request_approval(task_str: str) -> bool:
@@ -62,44 +92,164 @@ def request_approval(task_str: str) -> bool:
     return approved
 
 
-def run_task(task_str: str):
-    """CEO receives a task, routes it, executes, returns result."""
+# Compound requests (opt-in with --split): "then" starts a stage that waits
+# for the previous one; ";" and "and <action>" split a stage into parts that
+# run in parallel. Never applied to plain requests — ordinary prose ("fix the
+# bug where if the list is empty then it crashes") would be torn apart.
+THEN_RE = re.compile(r"\s*(?:,\s*)?\b(?:and\s+)?then\b[,\s]*", re.IGNORECASE)
+PART_RE = re.compile(r"\s*;\s*")
+AND_RE = re.compile(r"\s+and\s+", re.IGNORECASE)
+
+
+def decompose(task_str: str) -> list:
+    """Split a request into stages of subtask prompts: [[parallel, ...], [after those, ...]].
+
+    "and" only splits when the words after it start a new action (a routing
+    keyword such as "build" or "report"), so "compare A and B" stays whole.
+    A plain request comes back as [[task_str]].
+    """
+    stages = []
+    for stage_text in THEN_RE.split(task_str):
+        parts = []
+        for piece in PART_RE.split(stage_text):
+            chunks = AND_RE.split(piece)
+            current = chunks[0]
+            for chunk in chunks[1:]:
+                if ROUTER.scan(" ".join(chunk.split()[:2]))["director"]:
+                    parts.append(current)
+                    current = chunk
+                else:
+                    current += " and " + chunk
+            parts.append(current)
+        parts = [p.strip(" ,.") for p in parts if p.strip(" ,.")]
+        if parts:
+            stages.append(parts)
+    return stages or [[task_str]]
+
+
+def _enqueue_compound(task_str: str, stages: list, priority: int, deadline: datetime,
+                      memory: bool = False) -> tuple[int, list]:
+    """Queue a decomposed request: each stage's subtasks depend on every subtask of the stage before."""
+    children, previous = [], []
+    for stage in stages:
+        current = []
+        for prompt in stage:
+            route = classify(prompt)
+            children.append({
+                "assigned_to": route["director"],
+                "task_type": "subtask",
+                "payload": {**_task_payload(prompt, route, memory), "request": task_str},
+                "priority": priority,
+                "deadline": deadline,
+                "after": previous,
+            })
+            current.append(len(children) - 1)
+        previous = current
+    parent_id, child_ids = enqueue_dag(
+        {"task_type": "user_request", "payload": {"prompt": task_str}, "priority": priority, "deadline": deadline},
+        children,
+    )
+    return parent_id, [(child_id, c["assigned_to"], c["payload"]["prompt"]) for child_id, c in zip(child_ids, children)]
+
+
+def _wait_budget(stages: list) -> float:
+    """Seconds to wait for a request's result: per stage, its slowest director's retry budget."""
+    return sum(max(DIRECTORS[classify(prompt)["director"]].retry_budget() for prompt in stage)
+               for stage in stages)
+
+
+def _drain_until_final(task_ids: list, directors: set):
+    """Run the given directors here, on background threads, until every task in task_ids is final.
+
+    Each director re-drains after any task change (or every
+    SERVE_POLL_SECONDS), so a subtask is picked up as soon as the subtasks
+    it depends on finish, and a retry as soon as its backoff runs out.
+    """
+    def unfinished():
+        return [i for i in task_ids if (t := get_task(i)) and t["status"] not in FINAL_STATUSES]
+
+    def loop(name):
+        try:
+            # checked before every drain: once the caller has its result it may exit,
+            # and a drain started then would race interpreter shutdown
+            while waiting := unfinished():
+                DIRECTORS[name].process_pending()
+                wait_for_task(waiting[0], timeout=SERVE_POLL_SECONDS)
+        finally:
+            close_connection()
+
+    for name in directors:
+        threading.Thread(target=loop, args=(name,), name=f"inline-{name}", daemon=True).start()
+
+
+def _task_payload(task_str: str, route: dict, memory: bool = False) -> dict:
+    payload = {"prompt": task_str}
+    if memory:
+        payload["memory"] = True   # attach relevant shared memory (bypasses prompt-cache reuse)
+    if route["director"] == "analyst":
+        payload["task_type"] = route["analyst_type"] or "general"   # saves the analyst a re-scan
+    return payload
+
+
+def run_task(task_str: str, priority: int = 0, deadline: datetime = None, memory: bool = False,
+             split: bool = False):
+    """CEO receives a task, routes it, executes, returns result.
+
+    With split, the request is decomposed into dependent subtasks (see decompose).
+    """
     init_db()
+    route = classify(task_str)
 
     # Approval gate for shell tasks
-    if needs_approval(task_str):
+    if route["approval"]:
         if not request_approval(task_str):
             print("❌ Task denied by user.")
             audit_log("neo", "task_denied", task_str, result="denied")
             return None
 
-    director_name = route_task(task_str)
-    print(f"\n🧠 Neo → routing to [{director_name}]: {task_str[:80]}")
-    audit_log("neo", "route", task_str, result=director_name)
-
-    task_id = enqueue_task(
-        assigned_to=director_name,
-        task_type="user_request",
-        payload={"prompt": task_str}
-    )
+    stages = decompose(task_str) if split else [[task_str]]
+    timeout = _wait_budget(stages)
+    if sum(map(len, stages)) > 1:
+        director_name = "neo"
+        task_id, subtasks = _enqueue_compound(task_str, stages, priority, deadline, memory)
+        print(f"\n🧠 Neo → split into {len(subtasks)} subtasks over {len(stages)} stage(s):")
+        for sub_id, name, prompt in subtasks:
+            print(f"   #{sub_id} [{name}] {prompt[:70]}")
+        audit_log("neo", "decompose", task_str, result=",".join(f"{i}:{n}" for i, n, _ in subtasks), task_id=task_id)
+        if not daemon_running():
+            _drain_until_final([task_id], {name for _, name, _ in subtasks})
+    else:
+        director_name = route["director"]
+        print(f"\n🧠 Neo → routing to [{director_name}]: {task_str[:80]}")
+        audit_log("neo", "route", task_str, result=director_name)
 
-    director = DIRECTORS[director_name]
+        task_id = enqueue_task(
+            assigned_to=director_name,
+            task_type="user_request",
+            payload=_task_payload(task_str, route, memory),
+            priority=priority,
+            deadline=deadline,
+        )
+        # If a daemon is up it picks the task up, otherwise run it here (retries included)
+        if not daemon_running():
+            _drain_until_final([task_id], {director_name})
 
-    # Run with timeout
     start = time.time()
-    director.process_pending()
 
-    for _ in range(TASK_TIMEOUT_SECONDS):
-        task = get_task(task_id)
-        if task and task["status"] in ("done", "failed"):
+    while True:
+        remaining = max(0.0, timeout - (time.time() - start))
+        task = wait_for_task(task_id, timeout=min(remaining, STALL_CHECK_SECONDS))
+        if task and task["status"] in FINAL_STATUSES:
             break
-        if time.time() - start > TASK_TIMEOUT_SECONDS:
-            mark_failed(task_id, "Timed out")
+        if time.time() - start >= timeout:
+            if not mark_failed(task_id, "Timed out"):
+                task = get_task(task_id)   # it finished just now
+                break
             audit_log(director_name, "timeout", task_str, result="timeout", task_id=task_id)
-            print(f"\n⏱️  Task timed out after {TASK_TIMEOUT_SECONDS}s")
+            print(f"\n⏱️  Task timed out after {timeout:.0f}s")
             attempts = get_task_attempts(task_id)
             if attempts >= 2:
-                fire_alert(task_id, f"Timed out after {TASK_TIMEOUT_SECONDS}s", attempts)
+                fire_alert(task_id, f"Timed out after {timeout:.0f}s", attempts)
             return None
 
         # Check for pending_approval stall (>10 min)
@@ -112,8 +262,6 @@ def run_task(task_str: str):
             except Exception:
                 pass
 
-        time.sleep(1)
-
     if task["status"] == "done":
         audit_log(director_name, "task_done", task_str, result="ok", task_id=task_id)
         print(f"\n✅ Result:\n{task['result']}")
@@ -127,6 +275,187 @@ def run_task(task_str: str):
         return None
 
 
+def read_batch(source: str) -> list:
+    """Tasks from a file (or "-" for stdin): one per line, JSON or plain text.
+
+    A JSON line is an object with "prompt" and optionally "director",
+    "priority", "deadline"; any other keys go into the payload. Blank lines
+    and lines starting with # are skipped.
+    """
+    lines = sys.stdin.read().splitlines() if source == "-" else Path(source).read_text().splitlines()
+    tasks = []
+    for n, line in enumerate(lines, 1):
+        line = line.strip()
+        if not line or line.startswith("#"):
+            continue
+        if line.startswith("{"):
+            try:
+                spec = json.loads(line)
+            except ValueError as e:
+                raise SystemExit(f"{source}:{n}: invalid JSON: {e}")
+            if not spec.get("prompt"):
+                raise SystemExit(f"{source}:{n}: missing \"prompt\"")
+        else:
+            spec = {"prompt": line}
+        tasks.append(spec)
+    return tasks
+
+
+def run_batch(source: str, wait: bool = False, priority: int = 0):
+    """Route and enqueue every task in `source` in one transaction; print the ids.
+
+    Tasks that need shell approval are skipped (there is nobody to ask) —
+    submit those individually. With wait, results are printed as tasks
+    finish, in completion order.
+    """
+    init_db()
+    specs = read_batch(source)
+    rows, skipped = [], 0
+    for spec in specs:
+        spec = dict(spec)
+        prompt = spec["prompt"]
+        route = classify(prompt)
+        if route["approval"]:
+            print(f"⚠️  skipped (needs approval): {prompt[:80]}")
+            skipped += 1
+            continue
+        director = spec.pop("director", None) or route["director"]
+        if director not in DIRECTORS:
+            raise SystemExit(f"unknown director {director!r} for: {prompt[:80]}")
+        task_priority = spec.pop("priority", priority)
+        deadline = spec.pop("deadline", None)
+        rows.append({
+            "assigned_to": director,
+            "task_type": "user_request",
+            "payload": {**_task_payload(prompt, {**route, "director": director}), **spec},
+            "priority": _parse_priority(str(task_priority)),
+            "deadline": _parse_deadline(deadline) if deadline else None,
+        })
+    cursor = latest_event_id()
+    ids = enqueue_tasks(rows)
+    audit_log("neo", "batch_enqueue", f"{len(ids)} tasks from {source}, {skipped} skipped",
+              result=f"{ids[0]}-{ids[-1]}" if ids else "empty")
+    for task_id, row in zip(ids, rows):
+        print(f"{task_id}\t{row['assigned_to']}\t{row['payload']['prompt'][:80]}")
+    if not ids or not wait:
+        if ids and not daemon_running():
+            print("   (no daemon running — start `python main.py --serve` to process these)", file=sys.stderr)
+        return ids
+
+    if not daemon_running():
+        _drain_until_final(ids, {row["assigned_to"] for row in rows})
+    remaining = set(ids)
+    while remaining:
+        for event in wait_for_events(cursor, timeout=STALL_CHECK_SECONDS):
+            cursor = event["id"]
+            if event["task_id"] in remaining and event["status"] in FINAL_STATUSES:
+                remaining.discard(event["task_id"])
+                task = get_task(event["task_id"])
+                icon = "✅" if task["status"] == "done" else "❌"
+                print(f"\n{icon} [{task['id']}] {task['assigned_to']}: {task['result']}", flush=True)
+    return ids
+
+
+def daemon_running() -> bool:
+    """Return True if a --serve daemon is alive."""
+    try:
+        pid = int(PIDFILE.read_text().strip())
+        os.kill(pid, 0)
+    except (FileNotFoundError, ValueError, ProcessLookupError):
+        return False
+    except PermissionError:
+        return True   # alive, owned by another user
+    return True
+
+
+def serve(poll_seconds: float = SERVE_POLL_SECONDS, use_async: bool = False):
+    """Daemon mode — keep all Directors resident and drain their queues in parallel.
+
+    By default each Director drains on its own thread with its thread pool.
+    With use_async, one event loop drives every Director through the async
+    workers, and the workers.aio semaphores bound the subprocess count.
+    """
+    init_db()
+    if daemon_running():
+        print(f"❌ A daemon is already running (pid {PIDFILE.read_text().strip()}).")
+        return
+    PIDFILE.write_text(str(os.getpid()))
+    mode = "async" if use_async else "threads"
+    audit_log("neo", "serve_start", f"pid={os.getpid()} mode={mode} directors={','.join(DIRECTORS)}")
+    print(f"🧠 Neo daemon running (pid {os.getpid()}, {mode}) — directors: {', '.join(DIRECTORS)}")
+    try:
+        if use_async:
+            asyncio.run(_serve_async(poll_seconds))
+        else:
+            _serve_threads(poll_seconds)
+    finally:
+        PIDFILE.unlink(missing_ok=True)
+        audit_log("neo", "serve_stop", f"pid={os.getpid()}")
+        print("   Daemon stopped.")
+
+
+def _serve_threads(poll_seconds: float):
+    stop = threading.Event()
+
+    def _shutdown(signum, frame):
+        print("\n🛑 Shutting down — finishing in-flight tasks (Ctrl-C again to stop now)...")
+        stop.set()
+        signal.signal(signal.SIGINT, signal.default_int_handler)
+
+    signal.signal(signal.SIGINT, _shutdown)
+    signal.signal(signal.SIGTERM, _shutdown)
+
+    def _loop(director):
+        while not stop.is_set():
+            try:
+                director.process_pending(stop)
+            except Exception as e:
+                audit_log(director.name, "serve_error", str(e), result="error")
+                print(f"  ⚠️  [{director.name}] {e}")
+            stop.wait(poll_seconds)
+
+    threads = [
+        threading.Thread(target=_loop, args=(d,), name=f"serve-{name}", daemon=True)
+        for name, d in DIRECTORS.items()
+    ]
+    for t in threads:
+        t.start()
+    while any(t.is_alive() for t in threads):
+        for t in threads:
+            t.join(timeout=0.5)
+    for director in DIRECTORS.values():
+        director.close()
+
+
+async def _serve_async(poll_seconds: float):
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+
+    def _shutdown():
+        print("\n🛑 Shutting down — finishing in-flight tasks (Ctrl-C again to stop now)...")
+        stop.set()
+        loop.remove_signal_handler(signal.SIGINT)
+
+    loop.add_signal_handler(signal.SIGINT, _shutdown)
+    loop.add_signal_handler(signal.SIGTERM, _shutdown)
+
+    async def _loop(director):
+        while not stop.is_set():
+            try:
+                await director.process_pending_async(stop=stop)
+            except Exception as e:
+                audit_log(director.name, "serve_error", str(e), result="error")
+                print(f"  ⚠️  [{director.name}] {e}")
+            try:
+                await asyncio.wait_for(stop.wait(), poll_seconds)
+            except asyncio.TimeoutError:
+                pass
+
+    await asyncio.gather(*(_loop(d) for d in DIRECTORS.values()))
+    for director in DIRECTORS.values():
+        director.close()   # thread-backed directors' pools (see BaseDirector.run_task_async)
+
+
 def kill_all():
     """Kill all running agent subprocesses and clear pending tasks."""
     print("🛑 Killing all pending tasks...")
@@ -143,48 +472,157 @@ def kill_all():
 
 def show_status():
     """Show recent task queue status."""
-    tasks = list_tasks(10)
+    tasks = list_tasks(10, include_result=False)
     if not tasks:
         print("No tasks yet.")
         return
-    print(f"\n{'ID':<5} {'Director':<12} {'Status':<10} {'Type':<15} {'Created'}")
-    print("-" * 65)
+    print(f"\n{'ID':<5} {'Director':<12} {'Status':<10} {'Pri':>3}  {'Type':<15} {'Created'}")
+    print("-" * 70)
     for t in tasks:
-        print(f"{t['id']:<5} {t['assigned_to']:<12} {t['status']:<10} {t['task_type']:<15} {t['created_at'][:16]}")
+        retry = f"  (attempt {t['attempts'] + 1} not before {t['not_before'][11:19]})" if t["not_before"] else ""
+        print(f"{t['id']:<5} {t['assigned_to']:<12} {t['status']:<10} {t['priority']:>3}  "
+              f"{t['task_type']:<15} {t['created_at'][:16]}{retry}")
+
 
+def _print_output(chunks: list, after: int = 0) -> int:
+    """Write task_output chunks to stdout/stderr as captured; returns the last chunk id."""
+    for c in chunks:
+        (sys.stderr if c["stream"] == "stderr" else sys.stdout).write(c["text"])
+        after = c["id"]
+    sys.stdout.flush()
+    return after
 
-def show_audit(lines: int = 20):
-    """Tail the audit log."""
-    from pathlib import Path
-    log_path = Path(__file__).parent / "audit.log"
-    if not log_path.exists():
-        print("No audit log yet.")
+
+def tail_task(task_id: int, lines: int = 50, follow: bool = False):
+    """Print a task's last captured output lines; with follow, keep printing until it finishes."""
+    task = get_task(task_id)
+    if task is None:
+        print(f"No task {task_id}.")
         return
-    entries = log_path.read_text().strip().splitlines()
-    for line in entries[-lines:]:
-        try:
-            e = json.loads(line)
-            print(f"{e['ts'][:19]}  {e['agent']:<12} {e['action']:<18} {e['result']:<10} {e['detail'][:60]}")
-        except Exception:
-            print(line)
+    chunks = task_output_tail(task_id, lines)
+    if not chunks and not follow:
+        print(f"No output captured for task {task_id} ({task['status']}).")
+    after = _print_output(chunks)
+    while follow:
+        status = get_task(task_id)["status"]
+        done = status in FINAL_STATUSES
+        # once it's final, drain what's left without waiting
+        chunks = wait_for_task_output(task_id, after, 0 if done else TAIL_POLL_SECONDS)
+        after = _print_output(chunks, after)
+        if done and not chunks:
+            print(f"[task {task_id} {status}]")
+            return
+
+
+def show_audit(lines: int = 20, **filters):
+    """Tail the audit log, optionally filtered by agent/action/task_id/since/until."""
+    entries = audit_tail(lines, **filters)
+    if not entries:
+        print("No matching audit entries.")
+        return
+    for e in entries:
+        if "raw" in e:
+            print(e["raw"])
+            continue
+        print(f"{e['ts'][:19]}  {e['agent']:<12} {e['action']:<18} {e['result']:<10} {e['detail'][:60]}")
+
+
+def run_compact(vacuum: bool = False):
+    """Apply retention (memory history, task archive, event feed) and report space reclaimed."""
+    def mb(n):
+        return f"{n / 1024 / 1024:.1f} MB"
+
+    stats = compact(vacuum=vacuum)
+    before, after = stats["before"], stats["after"]
+    print(f"Memory rows pruned:   {stats['memory_pruned']}")
+    print(f"Tasks archived:       {stats['tasks_archived']}")
+    print(f"Events pruned:        {stats['events_pruned']}")
+    print(f"Database: {mb(before['file_bytes'] + before['wal_bytes'])} → "
+          f"{mb(after['file_bytes'] + after['wal_bytes'])} "
+          f"(reclaimed {mb(stats['reclaimed_bytes'])}, {mb(after['free_bytes'])} free for reuse)")
+    if after["free_bytes"] and not (vacuum or stats["incremental_vacuum"]):
+        print("   Run with --vacuum once to let future compactions shrink the file.")
+    audit_log("neo", "compact", json.dumps({k: v for k, v in stats.items() if k not in ("before", "after")}))
+
+
+def _parse_priority(text: str) -> int:
+    """--priority value: a level name (low/normal/high/urgent) or an integer."""
+    return PRIORITIES[text] if text in PRIORITIES else int(text)
+
+
+def _parse_deadline(text: str) -> datetime:
+    """--deadline value: relative (90s, 30m, 2h, 1d) or an ISO local timestamp."""
+    units = {"s": 1, "m": 60, "h": 3600, "d": 86400}
+    if text[:-1].isdigit() and text[-1] in units:
+        return datetime.now() + timedelta(seconds=int(text[:-1]) * units[text[-1]])
+    return datetime.fromisoformat(text)
+
+
+def _pop_option(args: list, name: str):
+    """Remove `name value` from args and return value (None if absent)."""
+    if name in args and args.index(name) + 1 < len(args):
+        i = args.index(name)
+        value = args[i + 1]
+        del args[i:i + 2]
+        return value
+    return None
+
+
+def _option(name: str, default=None):
+    """Value following `name` on the command line, e.g. --agent builder."""
+    args = sys.argv[2:]
+    if name in args and args.index(name) + 1 < len(args):
+        return args[args.index(name) + 1]
+    return default
 
 
 if __name__ == "__main__":
     if len(sys.argv) < 2:
-        print("Usage: python3 main.py 'Your task here'")
+        print("Usage: python3 main.py 'Your task here' [--priority low|normal|high|urgent|N] [--deadline 30m|ISO] "
+              "[--memory] [--split]")
         print("       python3 main.py --status")
-        print("       python3 main.py --audit")
+        print("       python3 main.py --audit [N] [--agent A] [--action X] [--task ID] [--since ISO] [--until ISO]")
+        print("       python3 main.py --tail ID [-f] [--lines N]")
         print("       python3 main.py --kill-all")
+        print("       python3 main.py --serve [--async]")
+        print("       python3 main.py --compact [--vacuum]")
+        print("       python3 main.py --batch FILE|- [--wait] [--priority P]")
         sys.exit(1)
 
     cmd = sys.argv[1]
     if cmd == "--status":
         show_status()
     elif cmd == "--audit":
-        lines = int(sys.argv[2]) if len(sys.argv) > 2 else 20
-        show_audit(lines)
+        lines = int(sys.argv[2]) if len(sys.argv) > 2 and sys.argv[2].isdigit() else 20
+        task = _option("--task")
+        show_audit(lines, agent=_option("--agent"), action=_option("--action"),
+                   task_id=int(task) if task else None,
+                   since=_option("--since"), until=_option("--until"))
+    elif cmd == "--tail":
+        if len(sys.argv) < 3 or not sys.argv[2].isdigit():
+            sys.exit("--tail needs a task id")
+        tail_task(int(sys.argv[2]), lines=int(_option("--lines", 50)), follow="-f" in sys.argv[3:])
     elif cmd == "--kill-all":
         kill_all()
+    elif cmd == "--serve":
+        serve(use_async="--async" in sys.argv[2:])
+    elif cmd == "--batch":
+        if len(sys.argv) < 3:
+            sys.exit("--batch needs a file, or - for stdin")
+        priority = _option("--priority")
+        run_batch(sys.argv[2], wait="--wait" in sys.argv[3:],
+                  priority=_parse_priority(priority) if priority else PRIORITIES["normal"])
+    elif cmd == "--compact":
+        run_compact(vacuum="--vacuum" in sys.argv[2:])
     else:
-        task_str = " ".join(sys.argv[1:])
-        run_task(task_str)
+        args = sys.argv[1:]
+        priority = _pop_option(args, "--priority")
+        deadline = _pop_option(args, "--deadline")
+        memory, split = "--memory" in args, "--split" in args
+        args = [a for a in args if a not in ("--memory", "--split")]
+        # Someone at a terminal is waiting on the answer; cron/scripts default to normal
+        default_priority = PRIORITIES["high"] if sys.stdin.isatty() else PRIORITIES["normal"]
+        run_task(" ".join(args),
+                 priority=_parse_priority(priority) if priority else default_priority,
+                 deadline=_parse_deadline(deadline) if deadline else None,
+                 memory=memory, split=split)
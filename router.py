@@ -0,0 +1,120 @@
+"""Keyword router — scores a prompt against every keyword table in one pass.
+
+All keywords of all tables are compiled once into a single regex built
+from a trie of the keywords, so the regex engine scans the prompt once
+in C. Each match is the longest keyword starting at that position. Every
+shorter keyword matching at the same position is a prefix of it, so
+those are credited from a precomputed list. The next search starts one
+character later, so overlapping keywords ("sec scan" / "scan ticker")
+are all found. Work per prompt grows with the prompt's length and
+number of hits, not with the number of tables or keywords.
+
+    router = Router(director={"builder": ["build", Keyword("fix", whole_word=True)]},
+                    approval={"shell": ["bash", ("run command", 2)]})
+    router.scan("Please build and fix it")
+    # {"director": {"builder": 2.0}, "approval": {}}
+
+Each keyword counts once per prompt, no matter how often it occurs. By
+default a keyword matches as a substring (so "scan" also hits "scanner"),
+which is the behaviour the old `kw in prompt.lower()` checks had.
+"""
+
+import re
+from dataclasses import dataclass
+
+
+@dataclass(frozen=True)
+class Keyword:
+    text: str
+    weight: float = 1.0
+    whole_word: bool = False   # require a non-word character (or the end) on both sides
+
+
+def _keyword(spec) -> Keyword:
+    """Accept "text", ("text", weight) or a Keyword."""
+    if isinstance(spec, Keyword):
+        kw = spec
+    elif isinstance(spec, tuple):
+        kw = Keyword(*spec)
+    else:
+        kw = Keyword(spec)
+    return Keyword(kw.text.lower(), kw.weight, kw.whole_word)
+
+
+def _trie_pattern(words) -> str:
+    """Regex matching the longest of `words` at a position, e.g. s(?:can(?: ticker)?|ec scan)."""
+    trie = {}
+    for word in words:
+        node = trie
+        for ch in word:
+            node = node.setdefault(ch, {})
+        node[""] = {}   # end-of-word marker
+
+    def build(node) -> str:
+        alts = [re.escape(ch) + build(child) for ch, child in sorted(node.items()) if ch]
+        if not alts:
+            return ""
+        body = alts[0] if len(alts) == 1 else "(?:" + "|".join(alts) + ")"
+        # greedy ? tries the longer continuation first, so the longest keyword wins
+        return f"(?:{body})?" if "" in node else body
+
+    return build(trie)
+
+
+class Router:
+    """Keyword tables compiled into one matcher.
+
+    Each keyword argument is a table of {label: [keyword, ...]}.
+    scan() returns {table: {label: summed weight}} with only the labels
+    that matched, in the order the table lists them.
+    """
+
+    def __init__(self, **tables: dict):
+        self._labels = {table: list(labels) for table, labels in tables.items()}
+        # keyword text -> [(table, label, Keyword), ...]
+        self._entries = {}
+        for table, labels in tables.items():
+            for label, specs in labels.items():
+                for spec in specs:
+                    kw = _keyword(spec)
+                    if kw.text:
+                        self._entries.setdefault(kw.text, []).append((table, label, kw))
+        words = sorted(self._entries)
+        # When a keyword matches, it and every keyword that is a prefix of it
+        # match at that position: word -> [(entry, length, whole_word), ...]
+        self._credits = {
+            w: [(entry, len(p), entry[2].whole_word) for p in words if w.startswith(p) for entry in self._entries[p]]
+            for w in words
+        }
+        self._regex = re.compile(_trie_pattern(words)) if words else None
+
+    def scan(self, text: str) -> dict:
+        totals = {}
+        lower = text.lower()
+        seen = set()
+        search = self._regex.search if self._regex else None
+        m = search(lower) if search else None
+        while m:
+            start = m.start()
+            for entry, length, whole_word in self._credits[m.group()]:
+                if entry in seen:
+                    continue
+                if whole_word and not self._bounded(lower, start, start + length):
+                    continue
+                seen.add(entry)
+                table, label, kw = entry
+                totals[table, label] = totals.get((table, label), 0) + kw.weight
+            m = search(lower, start + 1)
+        return {table: {label: totals[table, label] for label in labels if (table, label) in totals}
+                for table, labels in self._labels.items()}
+
+    @staticmethod
+    def _bounded(text: str, start: int, end: int) -> bool:
+        """True if text[start:end] is a whole word (no word character on either side)."""
+        return ((start == 0 or not (text[start - 1].isalnum() or text[start - 1] == "_"))
+                and (end == len(text) or not (text[end].isalnum() or text[end] == "_")))
+
+
+def best(scores: dict, default: str = None) -> str | None:
+    """Highest-scoring label of one table's scores, first-listed on ties; default if none matched."""
+    return max(scores, key=scores.get) if scores else default
@@ -0,0 +1,108 @@
+"""Outbox shipping against a local stub WorkLog server."""
+
+import json
+import tempfile
+import threading
+import time
+import unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+import database
+import worklog
+from database import get_connection, outbox_add
+
+
+class _StubWorkLog(BaseHTTPRequestHandler):
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        with self.server.lock:
+            self.server.received.append(body)
+        self.send_response(self.server.status)
+        self.end_headers()
+
+    def log_message(self, *args):
+        pass
+
+
+class ShipperTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.old_db = database.DB_PATH
+        database.DB_PATH = Path(self.tmp.name) / "test.db"
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), _StubWorkLog)
+        self.server.received, self.server.status, self.server.lock = [], 200, threading.Lock()
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.url = f"http://127.0.0.1:{self.server.server_port}/api/log"
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        database.close_connection()
+        database.DB_PATH = self.old_db
+        self.tmp.cleanup()
+
+    def _add(self, n: int, origin: str = None) -> list:
+        return [outbox_add({"description": f"entry {i}"}, origin=origin) for i in range(n)]
+
+    def _outbox(self) -> list:
+        with get_connection() as conn:
+            return [dict(r) for r in conn.execute("SELECT * FROM worklog_outbox ORDER BY id")]
+
+    def test_concurrent_shippers_post_each_entry_once(self):
+        self._add(60)
+        shippers = [worklog.Shipper(url=self.url, batch_size=7) for _ in range(3)]
+
+        def drain(shipper):
+            try:
+                while shipper.ship_once():
+                    pass
+            finally:
+                database.close_connection()
+
+        threads = [threading.Thread(target=drain, args=(s,)) for s in shippers]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+
+        descriptions = [body["description"] for body in self.server.received]
+        self.assertEqual(sorted(descriptions), sorted(f"entry {i}" for i in range(60)))
+        self.assertEqual(self._outbox(), [])
+
+    def test_failed_post_is_deferred_and_rest_released(self):
+        self.server.status = 503
+        self._add(3)
+        shipper = worklog.Shipper(url=self.url, batch_size=10)
+
+        self.assertEqual(shipper.ship_once(), 0)
+        self.assertEqual(len(self.server.received), 1)   # stops at the first failure
+        first, *rest = self._outbox()
+        self.assertEqual(first["attempts"], 1)
+        self.assertGreater(first["next_attempt_at"], time.time())
+        self.assertIsNone(first["claimed_by"])
+        for entry in rest:
+            self.assertEqual(entry["attempts"], 0)
+            self.assertIsNone(entry["claimed_by"])
+
+    def test_claimed_entries_are_skipped_until_the_claim_lapses(self):
+        self._add(2)
+        database.outbox_claim("dead-shipper", 10, claim_seconds=60)
+        shipper = worklog.Shipper(url=self.url)
+        self.assertEqual(shipper.ship_once(), 0)
+
+        with get_connection() as conn:
+            conn.execute("UPDATE worklog_outbox SET claim_expires = ?", (time.time() - 1,))
+        self.assertEqual(shipper.ship_once(), 2)
+
+    def test_stop_flushes_only_this_process_entries(self):
+        self._add(2, origin=worklog._process_id())
+        self._add(1, origin="elsewhere:1")
+        worklog.Shipper(url=self.url).stop(flush=True, timeout=2)
+
+        self.assertEqual(len(self.server.received), 2)
+        self.assertEqual([e["origin"] for e in self._outbox()], ["elsewhere:1"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,163 @@
+"""Async subprocess runner shared by the claude and shell workers.
+
+One event loop can keep hundreds of calls in flight without a thread each.
+Machine-wide load is capped by two semaphores, one for claude-wrapper
+(Max-plan rate limits) and one for shell commands. Every child is started
+in its own process group, so a timeout or cancellation kills the whole
+tree, not just the direct child. Output is read line by line and streamed
+into task_output, so a killed call keeps what it printed.
+
+Slots are shared fairly: when several directors are waiting, a freed slot
+goes to the next director in turn rather than to whoever queued the most
+calls.
+"""
+
+import asyncio
+import codecs
+import contextvars
+import weakref
+from collections import deque
+from workers.output import OutputCapture, FLUSH_SECONDS, READ_CHUNK, kill_group
+
+# Max concurrent claude-wrapper processes per event loop
+CLAUDE_CONCURRENCY = 3
+# Max concurrent shell commands per event loop
+SHELL_CONCURRENCY = 8
+
+# Who is asking for a slot — directors set this to their name for each task
+slot_owner = contextvars.ContextVar("slot_owner", default=None)
+
+
+class FairSlots:
+    """A semaphore that hands freed slots to waiting owners round-robin.
+
+    A plain asyncio.Semaphore is FIFO, so a director with 16 calls queued
+    starves one with a single call. Here each owner (see slot_owner) has
+    its own queue and a released slot goes to the owner that has waited
+    longest since it was last served.
+    """
+
+    def __init__(self, value: int):
+        self._free = value
+        self._waiters = {}   # owner -> deque of futures; dict order is the rotation
+
+    async def __aenter__(self):
+        await self.acquire()
+
+    async def __aexit__(self, *exc):
+        self.release()
+
+    async def acquire(self):
+        if self._free > 0 and not self._waiters:
+            self._free -= 1
+            return
+        owner = slot_owner.get()
+        fut = asyncio.get_running_loop().create_future()
+        self._waiters.setdefault(owner, deque()).append(fut)
+        try:
+            await fut
+        except asyncio.CancelledError:
+            if fut.done() and not fut.cancelled():
+                self.release()   # granted just as we were cancelled — pass it on
+            else:
+                queue = self._waiters.get(owner)
+                if queue and fut in queue:
+                    queue.remove(fut)
+                    if not queue:
+                        del self._waiters[owner]
+            raise
+
+    def release(self):
+        while self._waiters:
+            owner = next(iter(self._waiters))
+            queue = self._waiters.pop(owner)
+            fut = queue.popleft()
+            if queue:
+                self._waiters[owner] = queue   # back of the rotation
+            if not fut.done():
+                fut.set_result(None)
+                return
+        self._free += 1
+
+
+# asyncio primitives belong to one loop — keep a pair per running loop
+_slots = weakref.WeakKeyDictionary()
+
+
+def _loop_slots() -> dict:
+    loop = asyncio.get_running_loop()
+    if loop not in _slots:
+        _slots[loop] = {
+            "claude": FairSlots(CLAUDE_CONCURRENCY),
+            "shell": FairSlots(SHELL_CONCURRENCY),
+        }
+    return _slots[loop]
+
+
+def claude_slots() -> FairSlots:
+    return _loop_slots()["claude"]
+
+
+def shell_slots() -> FairSlots:
+    return _loop_slots()["shell"]
+
+
+async def _pump(reader, stream: str, capture: OutputCapture):
+    """Feed a stream to capture line by line; an overlong line is fed in pieces."""
+    decode = codecs.getincrementaldecoder("utf-8")(errors="replace").decode
+    rest = ""
+    while chunk := await reader.read(READ_CHUNK):
+        *lines, rest = (rest + decode(chunk)).split("\n")
+        for line in lines:
+            capture.feed(stream, line + "\n")
+        if len(rest) >= READ_CHUNK:
+            capture.feed(stream, rest)
+            rest = ""
+    rest += decode(b"", final=True)
+    if rest:
+        capture.feed(stream, rest)
+
+
+async def _flush_every(capture: OutputCapture, seconds: float):
+    while True:
+        await asyncio.sleep(seconds)
+        await asyncio.to_thread(capture.store, capture.take())
+
+
+async def run_exec(argv: list, timeout: float, slots: FairSlots,
+                   cwd: str = None) -> tuple[int, str, str]:
+    """Run argv under `slots`, returning (returncode, stdout, stderr).
+
+    Output is streamed into task_output as it arrives (see workers.output).
+    Raises asyncio.TimeoutError after `timeout` seconds. On timeout or
+    cancellation the child's process group is killed and reaped first, and
+    the output so far is kept.
+    """
+    capture = OutputCapture()
+    async with slots:
+        proc = await asyncio.create_subprocess_exec(
+            *argv,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.PIPE,
+            cwd=cwd,
+            start_new_session=True,   # own process group, so killpg reaches grandchildren
+        )
+        flusher = asyncio.create_task(_flush_every(capture, FLUSH_SECONDS))
+        running = asyncio.gather(_pump(proc.stdout, "stdout", capture),
+                                 _pump(proc.stderr, "stderr", capture),
+                                 proc.wait())
+        try:
+            await asyncio.wait_for(running, timeout)
+        except BaseException as e:
+            kill_group(proc)
+            await asyncio.shield(proc.wait())
+            # When we are cancelled, wait_for cancels the gather but never collects
+            # it, and asyncio would log its CancelledError as never retrieved.
+            await asyncio.shield(asyncio.gather(running, return_exceptions=True))
+            if isinstance(e, asyncio.TimeoutError):
+                capture.note(f"[killed after {timeout}s timeout]")
+            raise
+        finally:
+            flusher.cancel()
+            await asyncio.shield(asyncio.to_thread(capture.store, capture.take()))
+    return proc.returncode, capture.stdout, capture.stderr
@@ -1,21 +1,176 @@
 """Claude worker — runs claude -p subprocess for AI tasks."""
 
+import asyncio
+import hashlib
+import json
 import subprocess
+import threading
 import time
+from database import (cache_get, cache_put, default_worker_id, try_acquire_inflight,
+                      finish_inflight, get_inflight)
+from workers.aio import run_exec, claude_slots
+from workers.output import run_streaming
+from workers.errors import WorkerError, WorkerTimeout
 
+CLAUDE_BIN = "/Users/justinadair/bin/claude-wrapper"
 
-def run(prompt: str, timeout: int = 120) -> str:
-    """Run a prompt through Claude CLI and return the result."""
+# Identical prompts within this window are answered from the prompt cache
+CACHE_TTL_SECONDS = 6 * 3600
+# LRU bound on cached prompt results
+CACHE_MAX_ENTRIES = 2000
+
+# How often a process waiting on another process's identical prompt checks for the result
+INFLIGHT_POLL_SECONDS = 0.25
+# Extra time past the owner's own timeout before its cross-process lock is considered dead
+INFLIGHT_LEASE_GRACE_SECONDS = 30
+
+
+class _Flight:
+    """One in-progress prompt that concurrent callers in this process share."""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+_flights: dict[str, _Flight] = {}
+_flights_lock = threading.Lock()
+
+# run_async's equivalent of _flights, keyed by (event loop, prompt key)
+_async_flights: dict[tuple, asyncio.Future] = {}
+
+
+def cache_key(prompt: str) -> str:
+    """Content address for a prompt — covers everything that changes the answer."""
+    material = json.dumps({"bin": CLAUDE_BIN, "args": ["-p"], "prompt": prompt}, sort_keys=True)
+    return hashlib.sha256(material.encode("utf-8")).hexdigest()
+
+
+def run(prompt: str, timeout: int = 120, cache: bool = True) -> str:
+    """Run a prompt through Claude CLI and return the result.
+
+    Results are cached by prompt hash. cache=False skips the lookup (the
+    fresh result is still stored for later callers).
+
+    Identical prompts already running are not started twice: threads in
+    this process wait on the running call, and other processes wait on its
+    row in the inflight table. Either way they get its result or its error.
+    """
+    key = cache_key(prompt)
+    if cache:
+        hit = cache_get(key, CACHE_TTL_SECONDS)
+        if hit is not None:
+            return hit
+
+    with _flights_lock:
+        flight = _flights.get(key)
+        leader = flight is None
+        if leader:
+            flight = _flights[key] = _Flight()
+
+    if not leader:
+        if not flight.done.wait(timeout + INFLIGHT_LEASE_GRACE_SECONDS):
+            raise WorkerTimeout(f"Claude timed out after {timeout}s")
+        if flight.error is not None:
+            raise flight.error
+        return flight.result
+
+    try:
+        flight.result = _run_shared(key, prompt, timeout)
+        cache_put(key, flight.result, CACHE_MAX_ENTRIES)
+        return flight.result
+    except Exception as e:
+        flight.error = e
+        raise
+    finally:
+        with _flights_lock:
+            del _flights[key]
+        flight.done.set()
+
+
+def _run_shared(key: str, prompt: str, timeout: int) -> str:
+    """Run the prompt, or wait for another process that is already running it."""
+    owner = default_worker_id()
+    lease = timeout + INFLIGHT_LEASE_GRACE_SECONDS
+    deadline = time.monotonic() + lease
+    acquired = try_acquire_inflight(key, owner, lease)
+    while not acquired:
+        time.sleep(INFLIGHT_POLL_SECONDS)
+        row = get_inflight(key)
+        if row and row["state"] == "done":
+            return row["result"]
+        if row and row["state"] == "error":
+            raise WorkerError(row["error"])
+        if time.monotonic() > deadline:
+            raise WorkerTimeout(f"Claude timed out after {timeout}s")
+        # Only succeeds if the owner died and its lease lapsed
+        acquired = try_acquire_inflight(key, owner, lease)
+
+    try:
+        output = _run_claude(prompt, timeout)
+    except Exception as e:
+        finish_inflight(key, owner, error=str(e))
+        raise
+    finish_inflight(key, owner, result=output)
+    return output
+
+
+def _run_claude(prompt: str, timeout: int) -> str:
+    try:
+        returncode, stdout, stderr = run_streaming([CLAUDE_BIN, "-p", prompt], timeout)
+    except subprocess.TimeoutExpired as e:
+        raise WorkerTimeout(f"Claude timed out after {timeout}s", partial_output=e.output or "")
+    if returncode == 0:
+        return stdout.strip()
+    raise WorkerError(f"Claude error: {stderr.strip()}")
+
+
+async def run_async(prompt: str, timeout: int = 120, cache: bool = True) -> str:
+    """Async run() for event-loop callers (daemon).
+
+    Shares run()'s prompt cache. Identical prompts already in flight on the
+    same loop are awaited rather than started again. At most
+    aio.CLAUDE_CONCURRENCY claude-wrapper processes run at once.
+    """
+    key = cache_key(prompt)
+    if cache:
+        hit = await asyncio.to_thread(cache_get, key, CACHE_TTL_SECONDS)
+        if hit is not None:
+            return hit
+
+    loop = asyncio.get_running_loop()
+    flight = _async_flights.get((loop, key))
+    if flight is not None:
+        return await asyncio.shield(flight)
+
+    flight = _async_flights[(loop, key)] = loop.create_future()
+    try:
+        output = await _run_claude_async(prompt, timeout)
+        await asyncio.to_thread(cache_put, key, output, CACHE_MAX_ENTRIES)
+        flight.set_result(output)
+        return output
+    except asyncio.CancelledError:
+        # Followers must not inherit our cancellation — that would cancel
+        # their own tasks. They get a retryable timeout instead.
+        flight.set_exception(WorkerTimeout("Claude call abandoned: the task running it was cancelled"))
+        flight.exception()   # mark retrieved — no waiters is fine
+        raise
+    except Exception as e:
+        flight.set_exception(e)
+        flight.exception()   # mark retrieved — no waiters is fine
+        raise
+    finally:
+        del _async_flights[(loop, key)]
+
+
+async def _run_claude_async(prompt: str, timeout: int) -> str:
     try:
-        result = subprocess.run(
-            ["/Users/justinadair/bin/claude-wrapper", "-p", prompt],
-            capture_output=True,
-            text=True,
-            timeout=timeout
+        returncode, stdout, stderr = await run_exec(
+            [CLAUDE_BIN, "-p", prompt], timeout, claude_slots()
         )
-        if result.returncode == 0:
-            return result.stdout.strip()
-        else:
-            raise RuntimeError(f"Claude error: {result.stderr.strip()}")
-    except subprocess.TimeoutExpired:
-        raise RuntimeError(f"Claude timed out after {timeout}s")
+    except asyncio.TimeoutError:
+        raise WorkerTimeout(f"Claude timed out after {timeout}s")
+    if returncode == 0:
+        return stdout.strip()
+    raise WorkerError(f"Claude error: {stderr.strip()}")
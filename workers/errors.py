@@ -0,0 +1,26 @@
+"""Worker exception classes.
+
+All are RuntimeErrors, so existing `except RuntimeError` handlers keep
+working. Directors use the class to pick a retry policy (see
+BaseDirector.retry_policies).
+"""
+
+
+class WorkerError(RuntimeError):
+    """A worker call failed; may succeed if retried."""
+
+
+class WorkerTimeout(WorkerError):
+    """The subprocess (or the task as a whole) ran out of time.
+
+    partial_output is whatever the subprocess printed to stdout before it
+    was killed ("" if nothing, or not a subprocess timeout).
+    """
+
+    def __init__(self, message: str, partial_output: str = ""):
+        super().__init__(message)
+        self.partial_output = partial_output
+
+
+class CommandNotAllowed(WorkerError):
+    """The shell command is malformed or not on the allowlist — retrying can't help."""
@@ -0,0 +1,178 @@
+"""Streaming capture of worker subprocess output.
+
+Workers read their child's stdout and stderr line by line rather than all
+at once at exit. Lines are appended in small batches to the task_output
+table for the task being run (see current_task_id). That lets
+`main.py --tail` and GET /api/tasks/{id}/output follow a running task, and
+whatever was printed before a timeout is kept.
+
+Memory is bounded for chatty commands (pytest, git log). Each call holds
+at most MEMORY_MAX_CHARS of each stream, keeping the newest output. It
+stores at most TASK_OUTPUT_MAX_CHARS in task_output, then records a note
+and stops storing.
+"""
+
+import contextvars
+import os
+import signal
+import sqlite3
+import subprocess
+import threading
+import time
+from collections import deque
+from database import append_task_output
+
+# Task whose output is being captured — directors set this for each task they run
+current_task_id = contextvars.ContextVar("current_task_id", default=None)
+
+MEMORY_MAX_CHARS = 1024 * 1024        # per stream, per call — the returned text keeps the newest output
+TASK_OUTPUT_MAX_CHARS = 512 * 1024    # stored in task_output per call; past this only a note is added
+FLUSH_SECONDS = 0.5                   # how often buffered lines are written to task_output
+READ_CHUNK = 64 * 1024                # longest piece read at once; longer lines are captured in pieces
+
+
+class _Tail:
+    """The newest `limit` characters of a stream, kept as whole lines."""
+
+    def __init__(self, limit: int):
+        self.limit = limit
+        self.lines = deque()
+        self.size = 0
+        self.dropped = 0
+
+    def add(self, line: str):
+        self.lines.append(line)
+        self.size += len(line)
+        while self.size > self.limit and len(self.lines) > 1:
+            old = self.lines.popleft()
+            self.size -= len(old)
+            self.dropped += len(old)
+
+    def text(self) -> str:
+        head = f"[… {self.dropped} earlier characters dropped]\n" if self.dropped else ""
+        return head + "".join(self.lines)
+
+
+class OutputCapture:
+    """Collects one subprocess's output and stores it against a task.
+
+    feed() may be called from reader threads. take() and flush() hand the
+    pending chunks to the database. Without a task id, output is only kept
+    in memory.
+    """
+
+    def __init__(self, task_id: int = None):
+        self.task_id = task_id if task_id is not None else current_task_id.get()
+        self._tails = {"stdout": _Tail(MEMORY_MAX_CHARS), "stderr": _Tail(MEMORY_MAX_CHARS)}
+        self._pending = []
+        self._stored = 0
+        self._capped = False
+        self._lock = threading.Lock()
+
+    def feed(self, stream: str, line: str):
+        with self._lock:
+            self._tails[stream].add(line)
+            if self.task_id is None or self._capped:
+                return
+            if self._stored + len(line) > TASK_OUTPUT_MAX_CHARS:
+                self._capped = True
+                self._pending.append(("note", f"[output capped at {TASK_OUTPUT_MAX_CHARS} characters]\n"))
+                return
+            self._stored += len(line)
+            self._pending.append((stream, line))
+
+    def note(self, text: str):
+        """Record a line of our own (not the child's), e.g. why it was stopped."""
+        if self.task_id is not None:
+            with self._lock:
+                self._pending.append(("note", text + "\n"))
+
+    def take(self) -> list:
+        with self._lock:
+            chunks, self._pending = self._pending, []
+        return chunks
+
+    def store(self, chunks: list):
+        if not chunks:
+            return
+        try:
+            append_task_output(self.task_id, chunks)
+        except sqlite3.Error:
+            pass   # capture is best-effort — it must never fail the task itself
+
+    def flush(self):
+        self.store(self.take())
+
+    @property
+    def stdout(self) -> str:
+        with self._lock:
+            return self._tails["stdout"].text()
+
+    @property
+    def stderr(self) -> str:
+        with self._lock:
+            return self._tails["stderr"].text()
+
+
+def kill_group(proc):
+    try:
+        os.killpg(proc.pid, signal.SIGKILL)
+    except ProcessLookupError:
+        pass
+
+
+def _pump(pipe, stream: str, capture: OutputCapture):
+    with pipe:
+        for line in iter(lambda: pipe.readline(READ_CHUNK), ""):
+            capture.feed(stream, line)
+
+
+def run_streaming(argv: list, timeout: float, cwd: str = None,
+                  task_id: int = None) -> tuple[int, str, str]:
+    """Run argv like subprocess.run(capture_output=True, text=True), streaming its output.
+
+    Returns (returncode, stdout, stderr). Output goes to task_output as it
+    arrives (see OutputCapture). After `timeout` seconds the child's process
+    group is killed, and subprocess.TimeoutExpired is raised with the
+    partial stdout/stderr attached.
+    """
+    capture = OutputCapture(task_id)
+    proc = subprocess.Popen(
+        argv,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+        text=True,
+        errors="replace",
+        cwd=cwd,
+        start_new_session=True,   # own process group, so killpg reaches grandchildren
+    )
+    readers = [threading.Thread(target=_pump, args=(pipe, stream, capture), daemon=True)
+               for pipe, stream in ((proc.stdout, "stdout"), (proc.stderr, "stderr"))]
+    for r in readers:
+        r.start()
+
+    deadline = time.monotonic() + timeout
+    timed_out = False
+    try:
+        while True:
+            try:
+                proc.wait(max(0.0, min(FLUSH_SECONDS, deadline - time.monotonic())))
+                break
+            except subprocess.TimeoutExpired:
+                capture.flush()
+                if time.monotonic() >= deadline:
+                    timed_out = True
+                    break
+    finally:
+        if proc.returncode is None:
+            kill_group(proc)
+            proc.wait()
+        for r in readers:
+            r.join()
+        if timed_out:
+            capture.note(f"[killed after {timeout}s timeout]")
+        capture.flush()
+
+    if timed_out:
+        raise subprocess.TimeoutExpired(argv, timeout, output=capture.stdout, stderr=capture.stderr)
+    return proc.returncode, capture.stdout, capture.stderr
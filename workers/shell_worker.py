@@ -1,8 +1,12 @@
 """Shell worker — runs whitelisted commands safely within ~/projects/."""
 
+import asyncio
 import subprocess
 import shlex
 from pathlib import Path
+from workers.aio import run_exec, shell_slots
+from workers.output import run_streaming
+from workers.errors import WorkerError, WorkerTimeout, CommandNotAllowed
 
 ALLOWED_BASE = Path.home() / "projects"
 
@@ -13,31 +17,46 @@ ALLOWED_COMMANDS = {
 }
 
 
-def run(command: str, timeout: int = 60) -> str:
-    """Run a whitelisted shell command restricted to ~/projects/."""
+def _parse(command: str) -> list:
+    """Split a command and check it against the allowlist."""
     try:
         parts = shlex.split(command)
     except ValueError as e:
-        raise RuntimeError(f"Invalid command syntax: {e}")
+        raise CommandNotAllowed(f"Invalid command syntax: {e}")
 
     if not parts:
-        raise RuntimeError("Empty command")
+        raise CommandNotAllowed("Empty command")
 
     base_cmd = Path(parts[0]).name  # handles full paths like /usr/bin/git → git
     if base_cmd not in ALLOWED_COMMANDS:
-        raise RuntimeError(
+        raise CommandNotAllowed(
             f"Command '{base_cmd}' is not allowed. "
             f"Allowed: {', '.join(sorted(ALLOWED_COMMANDS))}"
         )
+    return parts
+
+
+def run(command: str, timeout: int = 60) -> str:
+    """Run a whitelisted shell command restricted to ~/projects/."""
+    parts = _parse(command)
 
-    result = subprocess.run(
-        parts,
-        shell=False,           # explicit list, no shell injection
-        capture_output=True,
-        text=True,
-        timeout=timeout,
-        cwd=str(ALLOWED_BASE)
-    )
-    if result.returncode != 0:
-        raise RuntimeError(f"Command failed: {result.stderr.strip()}")
-    return result.stdout.strip()
+    try:
+        # explicit argv list, no shell — nothing to inject into
+        returncode, stdout, stderr = run_streaming(parts, timeout, cwd=str(ALLOWED_BASE))
+    except subprocess.TimeoutExpired as e:
+        raise WorkerTimeout(f"Command timed out after {timeout}s", partial_output=e.output or "")
+    if returncode != 0:
+        raise WorkerError(f"Command failed: {stderr.strip()}")
+    return stdout.strip()
+
+
+async def run_async(command: str, timeout: int = 60) -> str:
+    """Async run(): same allowlist, gated by aio.SHELL_CONCURRENCY, process group killed on timeout."""
+    parts = _parse(command)
+    try:
+        returncode, stdout, stderr = await run_exec(parts, timeout, shell_slots(), cwd=str(ALLOWED_BASE))
+    except asyncio.TimeoutError:
+        raise WorkerTimeout(f"Command timed out after {timeout}s")
+    if returncode != 0:
+        raise WorkerError(f"Command failed: {stderr.strip()}")
+    return stdout.strip()
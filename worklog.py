@@ -1,21 +1,149 @@
-"""WorkLog integration — auto-logs agent sessions."""
+"""WorkLog integration — auto-logs agent sessions.
 
+log_to_worklog() only writes the entry to the worklog_outbox table. A
+background Shipper posts outbox entries in batches over one pooled
+requests.Session. Failed entries stay in the outbox with exponential
+backoff, and each process flushes the entries it logged at interpreter
+exit. A slow or down WorkLog server never blocks a director and never
+loses an entry.
+
+Every process that logs runs a shipper (daemon, inline CLI runs, batch
+--wait). Shippers claim entries atomically before posting, so an entry is
+posted by one of them only.
+"""
+
+import atexit
+import os
+import random
+import socket
+import threading
 import requests
 import time
+from database import outbox_add, outbox_claim, outbox_delete, outbox_defer, outbox_release
 
 WORKLOG_URL = "http://localhost:8092/api/log"
 WORKLOG_KEY = "wl-justin-2026"
 
+BATCH_SIZE = 20            # entries shipped per wake-up
+SHIP_INTERVAL = 5.0        # seconds between outbox sweeps when nothing wakes the shipper
+REQUEST_TIMEOUT = 3        # per POST
+BACKOFF_BASE = 2.0         # first retry delay, doubled per failed attempt
+BACKOFF_MAX = 15 * 60      # cap on retry delay
+SHUTDOWN_FLUSH_SECONDS = 5.0
+# A shipper's claim on a batch lapses after this, in case it died mid-post
+CLAIM_SECONDS = BATCH_SIZE * REQUEST_TIMEOUT + 60
+
+
+def _process_id() -> str:
+    return f"{socket.gethostname()}:{os.getpid()}"
+
 
 def log_to_worklog(project: str, description: str, actual_hours: float, task_type: str = "agent"):
-    try:
-        requests.post(WORKLOG_URL, json={
-            "project": project,
-            "description": description,
-            "task_type": task_type,
-            "actual_hours": actual_hours,
-            "manual_estimate": actual_hours * 5,
-            "timestamp": int(time.time() * 1000),
-        }, headers={"X-WL-Key": WORKLOG_KEY}, timeout=3)
-    except Exception:
-        pass
+    outbox_add({
+        "project": project,
+        "description": description,
+        "task_type": task_type,
+        "actual_hours": actual_hours,
+        "manual_estimate": actual_hours * 5,
+        "timestamp": int(time.time() * 1000),
+    }, origin=_process_id())
+    shipper().wake()
+
+
+class Shipper:
+    """Background thread that drains worklog_outbox to the WorkLog API."""
+
+    def __init__(self, url: str = WORKLOG_URL, key: str = WORKLOG_KEY,
+                 batch_size: int = BATCH_SIZE, interval: float = SHIP_INTERVAL, owner: str = None):
+        self.url = url
+        self.owner = owner or f"{_process_id()}:{id(self):x}"   # claim holder name
+        self.batch_size = batch_size
+        self.interval = interval
+        self.session = requests.Session()
+        self.session.headers["X-WL-Key"] = key
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._loop, name="worklog-shipper", daemon=True)
+            self._thread.start()
+        return self
+
+    def wake(self):
+        self._wake.set()
+
+    def ship_once(self, origin: str = None) -> int:
+        """Claim and post one batch of due entries. Returns how many were delivered.
+
+        origin limits the batch to entries logged by that process. Stops at
+        the first failure: that entry is deferred with backoff, and the rest
+        are released for the next sweep rather than hammering a down server.
+        """
+        batch = outbox_claim(self.owner, self.batch_size, CLAIM_SECONDS, origin)
+        sent, tried = [], set()
+        try:
+            for entry in batch:
+                tried.add(entry["id"])
+                try:
+                    resp = self.session.post(self.url, data=entry["payload"],
+                                             headers={"Content-Type": "application/json"},
+                                             timeout=REQUEST_TIMEOUT)
+                    resp.raise_for_status()
+                except requests.RequestException as e:
+                    delay = min(BACKOFF_MAX, BACKOFF_BASE * 2 ** entry["attempts"])
+                    outbox_defer(entry["id"], time.time() + delay * random.uniform(0.5, 1.0), str(e),
+                                 self.owner)
+                    break
+                sent.append(entry["id"])
+        finally:
+            if sent:
+                outbox_delete(sent, self.owner)
+            untried = [e["id"] for e in batch if e["id"] not in tried]
+            if untried:
+                outbox_release(untried, self.owner)
+        return len(sent)
+
+    def _loop(self):
+        while not self._stop.is_set():
+            self._wake.wait(self.interval)
+            self._wake.clear()
+            try:
+                while self.ship_once() == self.batch_size and not self._stop.is_set():
+                    pass   # full batch — more may be waiting
+            except Exception:
+                pass   # never let the shipper die; entries stay in the outbox
+
+    def stop(self, flush: bool = True, timeout: float = SHUTDOWN_FLUSH_SECONDS):
+        """Stop the thread, then try to deliver this process's due entries within timeout.
+
+        Entries other processes logged are left to their own shippers.
+        """
+        self._stop.set()
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+        deadline = time.monotonic() + timeout
+        while flush and time.monotonic() < deadline:
+            try:
+                if self.ship_once(origin=_process_id()) == 0:
+                    break
+            except Exception:
+                break
+        self.session.close()
+
+
+_shipper = None
+_shipper_lock = threading.Lock()
+
+
+def shipper() -> Shipper:
+    """The process-wide shipper, started on first use and flushed at exit."""
+    global _shipper
+    if _shipper is None:
+        with _shipper_lock:
+            if _shipper is None:
+                _shipper = Shipper().start()
+                atexit.register(_shipper.stop)
+    return _shipper